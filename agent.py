@@ -1,8 +1,6 @@
 from random import randint
 from mesa import Agent
 from numpy import random
-import operator
-from operator import attrgetter
 
 # GLOBAL VARIABLES:
 #--------------------------------------------------------------------------
@@ -22,42 +20,29 @@ OTHER_THRESHOLD = 11.085
 ASIAN_THRESHOLD = 10.9625
 BLACK_THRESHOLD = 10.925
 
+# Number of cells (manhattan distance) an offender can see a cop from:
+COP_VISION = 7
+
 # Threshold rates:
 ROBBERY_RATE = 14.753 # 14.75 produces an average of 39 robberies per month
 STOP_SEARCH_RATE = 10.91  # 10.91 produces an average of  22 stop and searches per month
 
 
-#----------------------------------------------------------------
-class StreetPatch(Agent):
-    """An agent that will be a patch in the map"""
-
-    def __init__(self, unique_id, model, position, risk, crime_incidents, grid_nr):
-        """
-        Initialises the agent instance.
-        """
-        super().__init__(unique_id, model)
-
-        # Create a list of x and y cor to generate a grid layout.
-        roads_xcor = list(range(0,400,3))
-        roads_ycor = list(range(0,400,6))
-        self.pos = position
-        self.risk = risk
-        self.crime_incidents = crime_incidents
-        self.grid_nr = grid_nr
-
-        if(self.pos[0] in roads_xcor) or (self.pos[1] in roads_ycor):
-            self.typ = "road"
-        else:
-            self.typ = "building"
-
-    def step(self):
-        return       
-
 #----------------------------------------------------------------
 class Civilian(Agent):
     """
     A member of the general population, which can either be a victim of street robbery or be the one committing it.
+
+    The attributes are slots (mesa's Agent has no __slots__, but as every attribute it sets is a
+    slot the instance __dict__ is never created). Positions and activity nodes are the shared
+    cell tuples of the street layer and the string states and ethnicities are shared constants.
     """
+    __slots__ = ("unique_id", "model", "pos", "ethnicity", "home", "prev_pos", "activity_nodes", "moving",
+        "destination", "timer", "travel_speed", "criminal_propensity", "chronic_offender", "time_to_offending",
+        "victimisation", "attractiveness", "perceived_guardianship", "perceived_capability", "N_victimised",
+        "zone", "stop_searched", "offend_score")
+    typ = "civilian"
+
     def __init__(self, 
     unique_id, 
     model, 
@@ -81,7 +66,6 @@ class Civilian(Agent):
     stop_searched):
         super().__init__(unique_id, model)
         self.pos = position
-        self.typ = "civilian"
         self.ethnicity = ethnicity  
         # Agent movement:
         self.home = position
@@ -107,7 +91,7 @@ class Civilian(Agent):
 
     def move(self):
         """
-        Inspect neighbours and move to the next cell towards the destination patch. 
+        Move to the next cell on the shortest road path towards the destination patch. 
         """
         if self.moving == "moving":
             if self.pos == self.home:
@@ -118,44 +102,17 @@ class Civilian(Agent):
                 else:
                     # 20% chance of selecting any other activity node
                     self.destination = self.random.choice([a_node for a_node in self.activity_nodes if a_node not in self.pos])
-            # Create list of possible neighbouring cells to move to. 
-            self.update_neighbors()
-            road_neighbours = []
-            for agent in self.neighbors:
-                if agent.pos == self.destination:
-                    self.model.grid.move_agent(self, self.destination) # Do nothing if the agent is at an activity node. 
-                else:
-                    if agent.typ == "road": 
-                        road_neighbours.append(agent.pos)
+            # Take the next step on the shortest path to the destination.
+            if self.pos != self.destination:
+                new_position = self.model.router.next_step(self.pos, self.destination)
+                if new_position is not None:
+                    self.prev_pos = self.pos
+                    self.move_to(new_position)
 
             # Check if agent has arrived. If agent has arrived at destination: set moving to "arrived". 
-            if self.destination == self.pos and self.moving == "moving":  
+            if self.destination == self.pos:  
                 self.moving = "arrived"
 
-            else:
-                # Creating empty lists for directing the agents.
-                right_dir = []
-                wrong_dir = []
-
-                # Create a list of right directions and wrong directions.
-                distance = tuple(map(operator.sub, self.destination, self.pos))
-                for coordinate in road_neighbours:
-                    if coordinate != self.prev_pos:
-                        next_distance = tuple(map(operator.sub, self.destination, coordinate))
-                        if ((abs(next_distance[0]) < abs(distance[0])) or (abs(next_distance[1]) < abs(distance[1]))):
-                            right_dir.append(coordinate)
-                        else:
-                            wrong_dir.append(coordinate)
-                
-                # Move to the right direction unless there is no right direction.
-                if len(right_dir) > 0:
-                    new_position = right_dir[0]
-                else:
-                    new_position = self.random.choice(wrong_dir)
-
-                self.prev_pos = self.pos
-                self.model.grid.move_agent(self, new_position)
-
         elif self.moving == "arrived":
             self.prev_pos = self.pos
             self.moving = "waiting"
@@ -167,27 +124,28 @@ class Civilian(Agent):
             if self.timer == 0:
                 self.moving = "moving"
 
+    def move_to(self, new_position):
+        """
+        Moves the civilian on the grid and updates the number of civilians per cell.
+        """
+        self.model.occupancy.move(self.pos, new_position)
+        self.model.grid.move_agent(self, new_position)
+
     def offend(self):
         """
         Check if a suitable victim is in the same cell.
         """
         if self.criminal_propensity > 0 and self.moving == "moving" and self.time_to_offending >= 0:
-            # Get information about agents on the same cell.
-            same_cell = self.model.grid.get_cell_list_contents(self.pos)
-            # Only select agents that are civilians
-            filtered_cell = []
-            for agent in same_cell:
-                if agent.typ == "civilian":
-                    filtered_cell.append(agent)
+            if self.model.occupancy.count(self.pos) < 2:
+                return # No one else on the cell.
+            # Get the civilians on the same cell.
+            filtered_cell = self.model.civilians_at(self.pos)
             the_offender = [self]
 
             if len(filtered_cell) > 1:
                 victim = self.random.choice([i for i in filtered_cell if i not in the_offender])
                 if self.cop_nearby() == False:
-                    road_risk = 10 # Road risk can't be 10 
-                    for f in same_cell:
-                        if f.typ == "road":
-                            road_risk = f.risk
+                    road_risk = self.model.streets.road_risk(self.pos) # Road risk can't be 10 
                     if road_risk < 10:
                         Nc = (len(filtered_cell) - 2) + victim.perceived_guardianship
                         guardianship = self.perceived_capability + Nc 
@@ -195,14 +153,10 @@ class Civilian(Agent):
                         self.offend_score = rational_choice_score
                         if rational_choice_score >= ROBBERY_RATE:
                             victim.N_victimised += 1
+                            self.model.victimisations.add(victim.zone, victim.ethnicity, self.model.streets.grid_nr[self.pos])
                             if self.criminal_propensity < 20:
                                 self.time_to_offending = self.time_to_offending_again()
-                                neighbours = self.model.grid.get_neighborhood(
-                                self.pos, moore=False, include_center = True, radius=2)                                 
-                                whos_here = self.model.grid.get_cell_list_contents(neighbours)
-                                for road in whos_here:
-                                    if road.typ == "road":
-                                        road.crime_incidents += 1
+                                self.model.streets.record_crime(self.pos, radius=2, tick=self.model.schedule.steps)
                     return
                 return
 
@@ -210,30 +164,11 @@ class Civilian(Agent):
         """
         Looks around to see if cops are nearby.
         """
-        vision = 7
-        cops_here = []
-        neighbours = self.model.grid.get_neighborhood(
-            self.pos, moore=False, radius=vision
-        )
-        whos_here = self.model.grid.get_cell_list_contents(neighbours)
-        for i in whos_here:
-            if i.typ == "cop":
-                cops_here.append(i)
-
-        if len(cops_here) > 0:
+        if self.model.cop_coverage.cop_nearby(self.pos):
             return True # Cops nearby
         else:
             return False # No cops nearby
 
-    def update_neighbors(self):
-        """
-        Look around and identify the neighbours.
-        """
-        self.neighborhood = self.model.grid.get_neighborhood(
-            self.pos, moore=False, radius=1
-        )
-        self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
-
     def step(self):
         """
         A single tick in the simulation. 
@@ -253,6 +188,18 @@ class Civilian(Agent):
         if 0 < self.criminal_propensity < 10:
             self.time_to_offending -= 1
 
+        # A waiting civilian does nothing until its timer runs out, so park it until then.
+        if self.moving == "waiting" and self.timer > 1:
+            self.model.schedule.park(self, self.timer)
+
+    def wake(self, skipped):
+        """
+        Catches up on the ticks skipped while parked by the scheduler.
+        """
+        self.timer -= skipped
+        if 0 < self.criminal_propensity < 10:
+            self.time_to_offending -= skipped
+
     def time_to_offending_again(self):
         """
         Returns the number of ticks before agent can offend again.
@@ -263,8 +210,12 @@ class Civilian(Agent):
 #----------------------------------------------------------------
 class Cop(Agent):
     """
-    A police agent that will patrol the map and reacts to crime.
+    A police agent that will patrol the map and reacts to crime. Its attributes are slots, as for Civilian.
     """
+    __slots__ = ("unique_id", "model", "pos", "home", "prev_pos", "patrol_node", "moving", "destination", "timer",
+        "travel_speed", "hotspot_patrol", "patrol_area", "stopsearch_score", "time_at_hotspot")
+    typ = "cop"
+
     def __init__(self, 
     unique_id, 
     model, 
@@ -280,7 +231,6 @@ class Cop(Agent):
     ):
         super().__init__(unique_id, model)
         self.pos = position
-        self.typ = "cop"     
         # Agent movement:
         self.home = position
         self.prev_pos = prev_position
@@ -296,7 +246,7 @@ class Cop(Agent):
 
     def move(self):
         """
-        Inspect neighbours and move to the next cell towards the destination patch. 
+        Move to the next cell on the shortest road path towards the destination patch. 
         """
         if self.moving == "moving":
             if self.pos == self.destination:
@@ -306,45 +256,19 @@ class Cop(Agent):
                         self.time_at_hotspot = 15
                 else:
                     self.destination = self.random_patrol_node_generator()
-            # Create list of possible neighbouring cells to move to. 
-            self.update_neighbors()
-            road_neighbours = []
-            for agent in self.neighbors:
-                if agent.pos == self.destination:
-                    self.model.grid.move_agent(self, self.destination) # Do nothing.  
-                else:
-                    if agent.typ == "road": 
-                        road_neighbours.append(agent.pos)
+            # Take the next step on the shortest path to the destination.
+            if self.pos != self.destination:
+                new_position = self.model.router.next_step(self.pos, self.destination)
+                if new_position is not None:
+                    self.prev_pos = self.pos
+                    self.move_to(new_position)
 
             # Check if agent has arrived. If agent has arrived at destination: set moving to "arrived". 
-            if self.destination == self.pos and self.moving == "moving":
+            if self.destination == self.pos:
                 if self.hotspot_patrol == True: 
                     self.moving = "at_the_scene"
                 elif self.hotspot_patrol == False:  
                     self.moving = "arrived"      
-
-            else:
-                # Creating empty lists for directing the agents.
-                right_dir = []
-                wrong_dir = []
-
-                distance = tuple(map(operator.sub, self.destination, self.pos))
-                for coordinate in road_neighbours:
-                    if coordinate != self.prev_pos:
-                        next_distance = tuple(map(operator.sub, self.destination, coordinate))
-                        if ((abs(next_distance[0]) < abs(distance[0])) or (abs(next_distance[1]) < abs(distance[1]))):
-                            right_dir.append(coordinate)
-                        else:
-                            wrong_dir.append(coordinate)
-                
-                # Move to the right direction unless there is no right direction.
-                if len(right_dir) > 0:
-                    new_position = right_dir[0]
-                else:
-                    new_position = self.random.choice(wrong_dir)
-
-                self.prev_pos = self.pos
-                self.model.grid.move_agent(self, new_position)
         
         elif self.moving == "arrived":
             self.prev_pos = self.pos # Reset prev_pos
@@ -354,27 +278,18 @@ class Cop(Agent):
             if self.time_at_hotspot == 0:
                 self.moving = "moving"
 
-
-    def update_neighbors(self):
+    def move_to(self, new_position):
         """
-        Look around and identify the neighbours.
+        Moves the cop on the grid and updates the cells it can see.
         """
-        self.neighborhood = self.model.grid.get_neighborhood(
-            self.pos, moore=False, radius=1
-        )
-        self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
+        self.model.cop_coverage.move(self.pos, new_position)
+        self.model.grid.move_agent(self, new_position)
     
     def random_patrol_node_generator(self):
         """
         Gives a random patrol node to a cop agent.
         """       
-        roads = [obj for obj in self.model.schedule.agents if isinstance(obj, StreetPatch)]
-        list_of_roads = []
-        for i in roads:
-            if i.typ == "road" and i.grid_nr == self.patrol_area:
-                list_of_roads.append(i.pos) 
-        
-        xy = self.random.choice(list_of_roads)
+        xy = self.model.streets.random_node(self.random, self.patrol_area, "road")
 
         return (xy)
 
@@ -382,31 +297,11 @@ class Cop(Agent):
         """
         Gives a hotspot node to a cop agent.
         """       
-        hotspots_values = []
-        hotspots = []
-        roads = [obj for obj in self.model.schedule.agents if isinstance(obj, StreetPatch)]
-
-        # Create a list of the top five crime hot spots.
-        for _ in range(5):
-            hotspot_incidents = max(roads, key=attrgetter("crime_incidents")) # Get the max hot spots
-             
-            if hotspot_incidents.crime_incidents > 0: # Are there more than 1 incident?
-                hotspots_values.append(hotspot_incidents.crime_incidents) # Add the crime incident value to list
-                roads.remove(hotspot_incidents)  
-        if len(hotspots_values) > 0: 
-            for i in roads:
-                if i.crime_incidents == hotspots_values[0] and len(hotspots) < 5:
-                    hotspots.append(i.pos)
-                elif i.crime_incidents == hotspots_values[1] and len(hotspots) < 5:
-                    hotspots.append(i.pos)
-                elif i.crime_incidents == hotspots_values[2] and len(hotspots) < 5:
-                    hotspots.append(i.pos)
-                elif i.crime_incidents == hotspots_values[3] and len(hotspots) < 5:
-                    hotspots.append(i.pos)
-                elif i.crime_incidents == hotspots_values[4] and len(hotspots) < 5:
-                    hotspots.append(i.pos)
-                
-            hotspots = [*set(hotspots)] # Remove duplicates
+        if self.model.zonal_hotspots:
+            zone = self.patrol_area # Strategic cops stay in their own patrol area.
+        else:
+            zone = None
+        hotspots = self.model.streets.top_hotspots(5, zone) # Get the top five crime hot spots.
 
         if len(hotspots) > 0:
             destination_hotspot = self.random.choice(hotspots) # Pick a random hot spot of the five.
@@ -420,13 +315,13 @@ class Cop(Agent):
         Stop and search a potential suspect in the same cell as an officer.
         """
         self.stopsearch_score = 0
-        # Get information about agents on the same cell.
-        same_cell = self.model.grid.get_cell_list_contents(self.pos)
-        # Only select agents that are civilians
-        filtered_cell = []
-        for agent in same_cell:
-            if agent.typ == "civilian":
-                filtered_cell.append(agent)
+        if self.model.engine is not None and self.model.engine.remote:
+            self.model.engine.request_stopsearch(self.pos) # Searched in the worker owning the cell.
+            return
+        if self.model.occupancy.count(self.pos) < 2:
+            return # Too few civilians on the cell.
+        # Get the civilians on the same cell.
+        filtered_cell = self.model.civilians_at(self.pos)
         the_police = [self]
         if len(filtered_cell) > 1:
             suspect = self.random.choice([i for i in filtered_cell if i not in the_police])
@@ -447,6 +342,7 @@ class Cop(Agent):
 
             if  stop_search_probability >= prob_stop:
                 suspect.stop_searched += 1
+                self.model.stop_searches.add(suspect.zone, suspect.ethnicity, self.model.streets.grid_nr[self.pos])
 
 
     def step(self):
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import argparse
+import multiprocessing
+import numpy as np
+from model import Map, MONTH
+from sweep import seed_everything
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Size of the city in the server, the base of the scaled sizes.
+BASE_N = 11402
+BASE_NC = 41
+BASE_WIDTH = 100
+BASE_HEIGHT = 103
+
+SCALES = (0.25, 0.5, 1, 2) # Factors of the number of civilians, cops and grid cells.
+WARMUP = 600 # Ticks run (and timed apart) before the steady state timings; every civilian leaves home within 600 ticks.
+WINDOW = 1000 # Ticks of the timed window.
+SINGLE_STEPS = 20 # Single steps timed after the warm up; the median is reported.
+SERIES = ("Victimised", "Stopped_Searched") # Series checked for reproducibility.
+TILINGS = ((1, 1), (2, 1), (2, 2), (3, 3)) # Tiles of the distributed cases, one worker process each.
+RESULTS_DIR = "bench_results"
+
+
+def scaled_params(scale, N_strategic_cops=10, ethnic_distribution=2):
+    """
+    Returns the model parameters of the base city scaled by a factor. The grid is scaled
+    in area, so the density of civilians stays the same.
+    """
+    side = np.sqrt(scale)
+    return {
+        "N": int(round(BASE_N * scale)),
+        "NC": max(int(round(BASE_NC * scale)), 1),
+        "width": int(round(BASE_WIDTH * side)),
+        "height": int(round(BASE_HEIGHT * side)),
+        "N_strategic_cops": N_strategic_cops,
+        "ethnic_distribution": ethnic_distribution,
+    }
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024 ** 2 # bytes
+    return peak / 1024 # kilobytes
+
+
+def seeded_model(params, seed, vectorised=False, profile=False):
+    """
+    Seeds the global generators and creates a model with the same seed.
+    """
+    seed_everything(seed)
+    return Map(**params, vectorised=vectorised, seed=seed, profile=profile)
+
+
+def time_case(params, seed, vectorised=False, window=WINDOW, month=False, profile=False, warmup=WARMUP):
+    """
+    Times the set up, warmup ticks (in which most routes are first computed), then in the
+    steady state single steps and a window of ticks, and optionally a full MONTH run of one model.
+    Returns the timings (seconds), ticks per second, peak RSS and the reproducibility series,
+    and the phase summary if profile is True (the timings then include the profiling overhead).
+    """
+    start = time.perf_counter()
+    model = seeded_model(params, seed, vectorised, profile)
+    result = {"init": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    for _ in range(warmup):
+        model.step()
+    result["warmup"] = time.perf_counter() - start
+
+    steps = []
+    for _ in range(SINGLE_STEPS):
+        start = time.perf_counter()
+        model.step()
+        steps.append(time.perf_counter() - start)
+    result["step"] = float(np.median(steps))
+
+    start = time.perf_counter()
+    for _ in range(window):
+        model.step()
+    result["window"] = time.perf_counter() - start
+    result["ticks_per_sec"] = window / result["window"]
+
+    if month:
+        start = time.perf_counter()
+        while model.running:
+            model.step()
+        result["month"] = result["warmup"] + sum(steps) + result["window"] + time.perf_counter() - start
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    result["series"] = {name: [int(v) for v in model.datacollector.model_vars[name]] for name in SERIES}
+    if profile:
+        result["profile"] = model.profiler.summary()
+    model.close()
+    return result
+
+
+def time_tiles(params, seed, tilings=TILINGS, window=WINDOW, warmup=WARMUP):
+    """
+    Times a window of ticks, after the warm up, of the single VectorEngine and of the distributed
+    engine with each tiling. Returns the wall times (seconds) by tiling ("NXxNY"), "single" for the
+    VectorEngine. On a machine with as many cores as tiles the time should fall as tiles are added.
+    """
+    times = {}
+    for tiles in (None,) + tuple(tilings):
+        seed_everything(seed)
+        if tiles is None:
+            model = Map(**params, vectorised=True, seed=seed)
+        else:
+            model = Map(**params, distributed=True, tiles=tiles, seed=seed)
+        try:
+            for _ in range(warmup):
+                model.step()
+            start = time.perf_counter()
+            for _ in range(window):
+                model.step()
+            times["single" if tiles is None else "{}x{}".format(*tiles)] = time.perf_counter() - start
+        finally:
+            model.close()
+    return times
+
+
+def _run_case(args):
+    return time_case(*args)
+
+
+def run_case(params, seed, vectorised=False, window=WINDOW, month=False, profile=False, warmup=WARMUP):
+    """
+    Runs time_case in a fresh process so that the peak RSS belongs to this case only.
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_run_case, ((params, seed, vectorised, window, month, profile, warmup),))
+
+
+def scaling_exponents(sizes, results):
+    """
+    Fits time ~ N^k for every timing and returns the exponents k.
+    """
+    exponents = {}
+    if len(sizes) < 2:
+        return exponents
+    for key in ("init", "warmup", "step", "window", "month"):
+        if all(key in r for r in results):
+            times = np.array([r[key] for r in results])
+            exponents[key] = float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+    return exponents
+
+
+def check_reproducible(params, seed, vectorised=False, ticks=200):
+    """
+    Runs the same seeded model twice and returns True if the SERIES are identical.
+    """
+    runs = [run_case(params, seed, vectorised, window=ticks, warmup=0)["series"] for _ in range(2)]
+    return runs[0] == runs[1]
+
+
+def compare(previous, current):
+    """
+    Returns the ratio current / previous of every timing for the scales both results have.
+    """
+    ratios = {}
+    old_cases = {case["scale"]: case for case in previous["cases"]}
+    for case in current["cases"]:
+        old = old_cases.get(case["scale"])
+        if old is None:
+            continue
+        ratios[case["scale"]] = {key: case[key] / old[key] for key in ("init", "warmup", "step", "window", "month")
+            if key in case and key in old and old[key] > 0}
+    return ratios
+
+
+def latest_result(results_dir):
+    """
+    Returns the most recent stored result, or None.
+    """
+    if not os.path.isdir(results_dir):
+        return None
+    files = sorted(f for f in os.listdir(results_dir) if f.endswith(".json"))
+    if not files:
+        return None
+    with open(os.path.join(results_dir, files[-1])) as f:
+        return json.load(f)
+
+
+def run_benchmark(scales=SCALES, seed=0, vectorised=False, window=WINDOW, month=False, results_dir=RESULTS_DIR,
+    profile=False, warmup=WARMUP, distributed=False):
+    """
+    Benchmarks every scale, checks the series against a repeated run and against the
+    previous stored result (same seed, warm up and window), stores the result and prints a report.
+    With distributed, also times the TILINGS of the largest scale against the single VectorEngine.
+    """
+    previous = latest_result(results_dir)
+    cases = []
+    for scale in scales:
+        params = scaled_params(scale)
+        case = run_case(params, seed, vectorised, window, month, profile, warmup)
+        case.update(scale=scale, **params)
+        cases.append(case)
+        print("scale {:>5}: N={:>6} init {:7.3f}s  warm up {:7.3f}s  step {:8.4f}s  {:8.1f} ticks/s  peak {:7.1f} MB".format(
+            scale, params["N"], case["init"], case["warmup"], case["step"], case["ticks_per_sec"], case["peak_rss_mb"]))
+        for row in case.get("profile", []):
+            print("    {:<42} {:>10} calls {:9.3f}s {:6.1%}".format(row["phase"], row["calls"], row["total_s"], row["share"]))
+
+    result = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": seed,
+        "vectorised": vectorised,
+        "warmup": warmup,
+        "window": window,
+        "cases": cases,
+        "exponents": scaling_exponents([c["N"] for c in cases], cases),
+        "reproducible": check_reproducible(scaled_params(scales[0]), seed, vectorised),
+    }
+    print("scaling exponents:", {key: round(k, 2) for key, k in result["exponents"].items()})
+    print("seeded runs identical:", result["reproducible"])
+
+    if distributed:
+        result["cores"] = multiprocessing.cpu_count()
+        result["tiles"] = time_tiles(scaled_params(scales[-1]), seed, window=window, warmup=warmup)
+        print("distributed, scale {} on {} cores:".format(scales[-1], result["cores"]))
+        for tiling, seconds in result["tiles"].items():
+            print("    {:<8} window {:8.3f}s  {:5.2f}x the single engine".format(tiling, seconds, result["tiles"]["single"] / seconds))
+
+    if previous is not None:
+        for scale, ratios in compare(previous, result).items():
+            print("scale {:>5} vs previous:".format(scale), {key: round(r, 2) for key, r in ratios.items()})
+        same_setup = all(previous.get(key) == result[key] for key in ("seed", "vectorised", "warmup", "window"))
+        if same_setup:
+            old_series = {case["scale"]: case["series"] for case in previous["cases"]}
+            matches = [case["series"] == old_series[case["scale"]] for case in cases if case["scale"] in old_series]
+            print("series identical to previous result:", all(matches))
+
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, result["time"].replace(":", "-") + ".json"), "w") as f:
+        json.dump(result, f)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot spots policing model.")
+    parser.add_argument("--scales", type=float, nargs="+", default=SCALES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=WARMUP, help="ticks before the steady state timings")
+    parser.add_argument("--window", type=int, default=WINDOW)
+    parser.add_argument("--month", action="store_true", help="also time a full MONTH ({} ticks) run".format(MONTH))
+    parser.add_argument("--vectorised", action="store_true")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--profile", action="store_true", help="time the phases of every tick")
+    parser.add_argument("--distributed", action="store_true",
+        help="also time the distributed engine with the tilings {} against the single engine".format(
+            ", ".join("{}x{}".format(*tiles) for tiles in TILINGS)))
+    args = parser.parse_args(argv)
+    run_benchmark(args.scales, args.seed, args.vectorised, args.window, args.month, args.results_dir, args.profile, args.warmup,
+        args.distributed)
+
+
+if __name__ == "__main__":
+    main()
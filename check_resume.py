@@ -0,0 +1,86 @@
+"""
+Checks that a model resumed from a checkpoint continues exactly as the run that was saved.
+
+    python check_resume.py [--N N] [--NC NC] [--seed S] [--save-at T] [--ticks T]
+
+For the object and the vectorised civilians, a seeded model is saved after --save-at ticks
+and run on for --ticks ticks, and the checkpoint is loaded and run for the same ticks. The
+series, the civilian table and the positions of all agents of both runs must be identical.
+"""
+import os
+import sys
+import argparse
+import tempfile
+from model import Map
+from sweep import seed_everything
+from checkpoint import save_checkpoint, load_checkpoint
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+N_AGENTS = 3000
+N_COPS = 100 # Many cops, so that stop and searches (which read the occupancy) are checked.
+WIDTH = 60
+HEIGHT = 60
+SAVE_AT = 50
+TICKS = 300
+
+
+def model_state(model):
+    """
+    Returns the series, the civilian table and the positions of the civilians and cops of a model.
+    """
+    table = model.civilian_table()
+    if model.engine is not None:
+        positions = model.engine.pos.tolist()
+    else:
+        positions = [a.pos for a in model.civilians]
+    return {
+        "series": {name: list(values) for name, values in model.datacollector.model_vars.items()},
+        "table": {name: column.tolist() for name, column in table.items()},
+        "civilian positions": positions,
+        "cop positions": [cop.pos for cop in model.cops],
+    }
+
+
+def check_resume(vectorised, N=N_AGENTS, NC=N_COPS, seed=0, save_at=SAVE_AT, ticks=TICKS):
+    """
+    Runs a model with and without a restart from a checkpoint. Returns the names of the parts
+    of the state that differ (empty if the resumed run is identical).
+    """
+    seed_everything(seed)
+    model = Map(N, NC, WIDTH, HEIGHT, 50, 2, vectorised=vectorised, seed=seed)
+    for _ in range(save_at):
+        model.step()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "model.ckpt")
+        save_checkpoint(model, path)
+        for _ in range(ticks):
+            model.step()
+        resumed = load_checkpoint(path)
+    for _ in range(ticks):
+        resumed.step()
+
+    expected, state = model_state(model), model_state(resumed)
+    return [name for name in expected if expected[name] != state[name]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that resumed runs continue identically.")
+    parser.add_argument("--N", type=int, default=N_AGENTS)
+    parser.add_argument("--NC", type=int, default=N_COPS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-at", type=int, default=SAVE_AT)
+    parser.add_argument("--ticks", type=int, default=TICKS)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for vectorised in (False, True):
+        differences = check_resume(vectorised, args.N, args.NC, args.seed, args.save_at, args.ticks)
+        print("{:<10} {}".format("vectorised" if vectorised else "objects",
+            "identical" if not differences else "differs in " + ", ".join(differences)))
+        failed = failed or bool(differences)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
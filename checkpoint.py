@@ -0,0 +1,67 @@
+import os
+import gc
+import gzip
+import pickle
+import random
+from contextlib import contextmanager
+import numpy as np
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+CHECKPOINT_VERSION = 1
+COMPRESSION_LEVEL = 1 # Fast gzip compression; the arrays compress well.
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pauses the garbage collector, which otherwise runs over and over while the many
+    agent objects of a checkpoint are created and slows loading down several times.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def save_checkpoint(model, path):
+    """
+    Writes the complete state of a model to a binary checkpoint file.
+
+    The model is pickled together with the state of the global random number generators
+    (the random module and numpy.random) that the agents draw from. Routes are left out and
+    computed again when needed, as they only depend on the street layer. The file is written
+    to a temporary name first so that an interrupted save keeps the previous checkpoint.
+    """
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "model": model,
+        "random": random.getstate(),
+        "np_random": np.random.get_state(),
+    }
+    temp_path = path + ".tmp"
+    with gzip.open(temp_path, "wb", compresslevel=COMPRESSION_LEVEL) as f, gc_paused():
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Reads a checkpoint written by save_checkpoint, restores the global random number generators
+    and returns the model, which continues exactly as the run that was saved. A profiler that
+    was enabled when the checkpoint was written is enabled again and goes on adding to its ticks.
+    """
+    with gzip.open(path, "rb") as f, gc_paused():
+        state = pickle.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version: {}".format(state.get("version")))
+    random.setstate(state["random"])
+    np.random.set_state(state["np_random"])
+    model = state["model"]
+    profiler = getattr(model, "profiler", None)
+    if profiler is not None and profiler.__dict__.pop("was_enabled", False):
+        profiler.enable()
+    return model
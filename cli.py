@@ -0,0 +1,287 @@
+"""
+Command line entry point of the hot spots policing model.
+
+    python cli.py run    [model options] [--ticks T] [--out DIR] [--checkpoint-every K --checkpoint FILE] [--resume FILE]
+    python cli.py sweep  [model options] --strategic-levels 0 10 ... --distributions 1 2 --iterations R --out DIR
+                         [--target-width W [--confidence C] [--min-iterations M] [--budget B]]
+                         [--summarise [--sample-rows S]]
+    python cli.py ensemble [model options] --replicates R [--ticks T] [--csv FILE]
+    python cli.py serve  [model options] [--port P] [--background [--ticks-per-frame T]]
+    python cli.py bench  [bench.py options]
+
+Modules are imported by the command that needs them, so only serve loads the visualisation.
+"""
+import sys
+import argparse
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Default size of the city, as in the server.
+N_AGENTS = 11402
+N_COPS = 41
+WIDTH = 100
+HEIGHT = 103
+ETHNIC_DISTRIBUTION = 2
+TICKS_PER_FRAME = 60 # As in the server.
+
+
+def add_model_arguments(parser):
+    """
+    Adds the options of the model parameters to a parser.
+    """
+    parser.add_argument("--N", type=int, default=N_AGENTS, help="number of civilians")
+    parser.add_argument("--NC", type=int, default=N_COPS, help="number of cops")
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--ethnic-distribution", type=int, default=ETHNIC_DISTRIBUTION, choices=(1, 2),
+        help="1 = homogenous, 2 = uniform")
+    parser.add_argument("--zonal-hotspots", action="store_true", help="hot spot cops stay in their patrol area")
+    parser.add_argument("--vectorised", action="store_true", help="use the vectorised civilian engine")
+    parser.add_argument("--layout", default=None, metavar="DIR",
+        help="directory of the road.npy, zones.npy and optional risk.npy of the city (replaces --width and --height)")
+    parser.add_argument("--zones", type=int, nargs=2, default=None, metavar=("ACROSS", "DOWN"),
+        help="zones of the grid city (default: 2 2)")
+    parser.add_argument("--road-spacing", type=int, nargs=2, default=None, metavar=("X", "Y"),
+        help="a road on every X-th column and Y-th row of the grid city (default: 3 6)")
+    parser.add_argument("--distributed", action="store_true",
+        help="run the civilians of each zone (or tile) in its own process (sweeps run one model at a time)")
+    parser.add_argument("--tiles", type=int, nargs=2, default=None, metavar=("NX", "NY"),
+        help="split the map into NX by NY tiles instead of the zones with --distributed")
+    parser.add_argument("--crime-half-life", type=float, default=None,
+        help="half life (ticks) of the crime density that hot spots are based on (default: no decay)")
+
+
+def make_layout(args):
+    """
+    Returns the layout of the parsed options: the directory of its files, a grid city with
+    the given zones and road spacing, or None for the default grid city.
+    """
+    if args.layout is not None:
+        return args.layout
+    if args.zones is None and args.road_spacing is None:
+        return None
+    from layout import grid_layout, ROAD_X_SPACING, ROAD_Y_SPACING, ZONES
+
+    x_spacing, y_spacing = args.road_spacing or (ROAD_X_SPACING, ROAD_Y_SPACING)
+    return grid_layout(args.width, args.height, x_spacing, y_spacing, tuple(args.zones or ZONES))
+
+
+def model_params(args):
+    """
+    Returns the model parameters of the parsed options, except N_strategic_cops.
+    """
+    return {
+        "N": args.N,
+        "NC": args.NC,
+        "width": args.width,
+        "height": args.height,
+        "ethnic_distribution": args.ethnic_distribution,
+        "zonal_hotspots": args.zonal_hotspots,
+        "vectorised": args.vectorised,
+        "crime_half_life": args.crime_half_life,
+        "layout": make_layout(args),
+        "distributed": args.distributed,
+        "tiles": args.tiles,
+    }
+
+
+def run(args):
+    """
+    Runs one model, optionally writing checkpoints or resuming from one.
+    """
+    from model import Map, RUN_LENGTH
+    from sweep import seed_everything
+    from checkpoint import load_checkpoint
+
+    if args.resume:
+        model = load_checkpoint(args.resume)
+        if args.profile and model.profiler is None:
+            from profiling import PhaseProfiler
+            model.profiler = PhaseProfiler() # Times the ticks after the checkpoint.
+            model.profiler.enable()
+    else:
+        seed_everything(args.seed)
+        model = Map(
+            **model_params(args),
+            N_strategic_cops=args.strategic,
+            seed=args.seed,
+            collect_period=args.collect_period,
+            collect_changes=args.collect_changes,
+            collect_path=args.out,
+            checkpoint_every=args.checkpoint_every,
+            checkpoint_path=args.checkpoint,
+            profile=args.profile)
+
+    ticks = RUN_LENGTH if args.ticks is None else args.ticks
+    try:
+        while model.running and model.schedule.steps < ticks:
+            model.step()
+    finally:
+        model.close()
+
+    print("ticks: {}  victimised: {}  stopped and searched: {}".format(
+        model.schedule.steps, model.victimisations.total, model.stop_searches.total))
+    if model.profiler is not None:
+        print(model.profiler.report())
+    if args.memory:
+        from memory import memory_report, format_memory_report
+        print(format_memory_report(memory_report(model)))
+
+
+def sweep(args):
+    """
+    Runs a parameter sweep in a process pool, with a fixed number of iterations or,
+    with --target-width, until the confidence intervals of the runs are narrow enough.
+    """
+    from model import RUN_LENGTH
+    from sweep import run_sweep, run_adaptive_sweep, load_sweep
+
+    if args.distributed and args.processes not in (None, 1):
+        sys.exit("A distributed model starts its own processes, so a sweep with --distributed runs with --processes 1")
+    options = {
+        "processes": args.processes,
+        "base_seed": args.seed,
+        "max_steps": RUN_LENGTH if args.ticks is None else args.ticks,
+        "data_collection_period": RUN_LENGTH if args.collect_period is None else args.collect_period,
+        "display_progress": not args.quiet,
+        "summarised": args.summarise,
+        "sample_rows": args.sample_rows,
+    }
+    if args.target_width is None:
+        done = run_sweep(model_params(args), args.strategic_levels, args.distributions, args.iterations, args.out, **options)
+        print("{} runs done".format(len(done)))
+    else:
+        summary = run_adaptive_sweep(model_params(args), args.strategic_levels, args.distributions, args.out,
+            target_width=args.target_width, confidence=args.confidence, min_iterations=args.min_iterations,
+            max_iterations=args.iterations, budget=args.budget, **options)
+        print(summary[["N_strategic_cops", "ethnic_distribution", "iterations", "converged"]].to_string(index=False))
+    if args.csv:
+        load_sweep(args.out).to_csv(args.csv)
+
+
+def ensemble(args):
+    """
+    Runs replicates of one model in lockstep and writes their series.
+    """
+    from model import RUN_LENGTH
+    from ensemble import Ensemble
+
+    params = model_params(args)
+    if params.pop("distributed"):
+        sys.exit("The replicates of an ensemble share one engine, which --distributed does not")
+    for name in ("tiles", "vectorised"):
+        params.pop(name)
+    runs = Ensemble(args.replicates, **params, N_strategic_cops=args.strategic, seed=args.seed, collect_period=0,
+        profile=args.profile)
+    try:
+        runs.run(RUN_LENGTH if args.ticks is None else args.ticks)
+    finally:
+        runs.close()
+
+    for r, model in enumerate(runs.models):
+        print("replicate: {}  victimised: {}  stopped and searched: {}".format(
+            r, model.victimisations.total, model.stop_searches.total))
+    if runs.profiler is not None:
+        print(runs.profiler.report())
+    if args.csv:
+        runs.series().to_csv(args.csv, index=False)
+
+
+def serve(args):
+    """
+    Launches the visualisation server.
+    """
+    import server
+
+    params = model_params(args)
+    if params.pop("distributed"):
+        sys.exit("serve draws the civilians, which --distributed keeps in other processes")
+    params.pop("tiles")
+    server.make_server(**params, port=args.port, background=args.background,
+        ticks_per_frame=args.ticks_per_frame).launch()
+
+
+def bench(args):
+    """
+    Runs the benchmark suite with the options of bench.py.
+    """
+    import bench
+
+    bench.main(args.options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hot spots policing model.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = commands.add_parser("run", help="run one model")
+    add_model_arguments(parser_run)
+    parser_run.add_argument("--strategic", type=int, default=10, help="percentage of hot spots policing patrols")
+    parser_run.add_argument("--seed", type=int, default=None)
+    parser_run.add_argument("--ticks", type=int, default=None, help="number of ticks (default: RUN_LENGTH)")
+    parser_run.add_argument("--collect-period", type=int, default=None,
+        help="ticks between civilian records (default: none)")
+    parser_run.add_argument("--collect-changes", action="store_true", help="only record civilians whose counts changed")
+    parser_run.add_argument("--out", default=None, help="directory of the collected data")
+    parser_run.add_argument("--checkpoint-every", type=int, default=None)
+    parser_run.add_argument("--checkpoint", default="model.ckpt", help="checkpoint file")
+    parser_run.add_argument("--resume", default=None, help="resume from this checkpoint file")
+    parser_run.add_argument("--profile", action="store_true", help="time the phases of every tick")
+    parser_run.add_argument("--memory", action="store_true", help="report the memory per agent type after the run")
+    parser_run.set_defaults(func=run)
+
+    parser_sweep = commands.add_parser("sweep", help="run a parameter sweep")
+    add_model_arguments(parser_sweep)
+    parser_sweep.add_argument("--strategic-levels", type=int, nargs="+", default=[10])
+    parser_sweep.add_argument("--distributions", type=int, nargs="+", default=[ETHNIC_DISTRIBUTION])
+    parser_sweep.add_argument("--iterations", type=int, default=1,
+        help="iterations of every configuration (with --target-width: the most iterations)")
+    parser_sweep.add_argument("--target-width", type=float, default=None,
+        help="add iterations until the confidence interval of every metric is at most this times its mean")
+    parser_sweep.add_argument("--confidence", type=float, default=0.95, help="confidence level of the intervals")
+    parser_sweep.add_argument("--min-iterations", type=int, default=5, help="iterations before the intervals are checked")
+    parser_sweep.add_argument("--budget", type=int, default=None, help="most runs of an adaptive sweep")
+    parser_sweep.add_argument("--out", default="sweep_runs", help="directory of the run files")
+    parser_sweep.add_argument("--csv", default=None, help="also combine the runs into this CSV file")
+    parser_sweep.add_argument("--processes", type=int, default=None, help="worker processes (default: all cores)")
+    parser_sweep.add_argument("--seed", type=int, default=0, help="base seed of the runs")
+    parser_sweep.add_argument("--ticks", type=int, default=None, help="number of ticks (default: RUN_LENGTH)")
+    parser_sweep.add_argument("--collect-period", type=int, default=None,
+        help="ticks between civilian records (default: RUN_LENGTH)")
+    parser_sweep.add_argument("--summarise", action="store_true",
+        help="write a summary by ethnicity and zone of every run instead of its civilian rows")
+    parser_sweep.add_argument("--sample-rows", type=int, default=0,
+        help="with --summarise, also write the rows of this many random civilians of every run")
+    parser_sweep.add_argument("--quiet", action="store_true")
+    parser_sweep.set_defaults(func=sweep)
+
+    parser_ensemble = commands.add_parser("ensemble", help="run replicates of one model in lockstep")
+    add_model_arguments(parser_ensemble)
+    parser_ensemble.add_argument("--replicates", type=int, default=10)
+    parser_ensemble.add_argument("--strategic", type=int, default=10, help="percentage of hot spots policing patrols")
+    parser_ensemble.add_argument("--seed", type=int, default=0, help="seed from which the replicate seeds are derived")
+    parser_ensemble.add_argument("--ticks", type=int, default=None, help="number of ticks (default: RUN_LENGTH)")
+    parser_ensemble.add_argument("--csv", default=None, help="write the series of the replicates to this CSV file")
+    parser_ensemble.add_argument("--profile", action="store_true", help="time the phases of every tick of all replicates")
+    parser_ensemble.set_defaults(func=ensemble)
+
+    parser_serve = commands.add_parser("serve", help="launch the visualisation server")
+    add_model_arguments(parser_serve)
+    parser_serve.add_argument("--port", type=int, default=8521)
+    parser_serve.add_argument("--background", action="store_true", help="run the model in a background thread")
+    parser_serve.add_argument("--ticks-per-frame", type=int, default=TICKS_PER_FRAME,
+        help="ticks between two frames with --background")
+    parser_serve.set_defaults(func=serve)
+
+    parser_bench = commands.add_parser("bench", help="run the benchmark suite (options of bench.py)", add_help=False)
+    parser_bench.set_defaults(func=bench)
+
+    # The options of bench are passed on to bench.py.
+    args, args.options = parser.parse_known_args(argv)
+    if args.options and args.command != "bench":
+        parser.error("unrecognized arguments: " + " ".join(args.options))
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import os
+from functools import partial
+import numpy as np
+from mesa.datacollection import DataCollector
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Number of agent rows kept in memory before a chunk is written to disk.
+CHUNK_ROWS = 1000000
+
+# Columns of the civilian level data, after Step and AgentID.
+AGENT_COLUMNS = ("Ethnicity", "zone", "N_victimised", "N_stop_searched")
+
+
+def get_attribute(name, agent):
+    """Returns an attribute of the agent, or None if the agent does not have it (cops)."""
+    return getattr(agent, name, None)
+
+
+#----------------------------------------------------------------
+class StreamingDataCollector(DataCollector):
+    """
+    A DataCollector that records the model reporters every tick and civilian level data
+    (AGENT_COLUMNS) in bounded memory.
+
+    Civilian rows are recorded every period ticks, and if on_change is True only for the
+    civilians whose N_victimised or stop_searched changed since the last record. By default
+    (period None) no civilian rows are recorded, as rows of every civilian every tick soon
+    fill the memory. Cops are not recorded. Without a path the rows are kept in memory as with DataCollector (so batch_run
+    can read them); with a path they are written to disk in chunks of chunk_rows rows,
+    as .npz files or, if fmt is "parquet", as Parquet files (requires pyarrow).
+    """
+    def __init__(self, model_reporters, period=None, on_change=False, path=None, chunk_rows=CHUNK_ROWS, fmt="npz"):
+        super().__init__(
+            model_reporters=model_reporters,
+            agent_reporters={
+                "Ethnicity": partial(get_attribute, "ethnicity"),
+                "zone": partial(get_attribute, "zone"),
+                "N_victimised": partial(get_attribute, "N_victimised"),
+                "N_stop_searched": partial(get_attribute, "stop_searched")
+            })
+        if fmt not in ("npz", "parquet"):
+            raise ValueError("Unknown output format: {}".format(fmt))
+        self.period = period
+        self.on_change = on_change
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.fmt = fmt
+        self.buffer = []
+        self.buffered_rows = 0
+        self.n_chunks = 0
+        self.last_values = None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def collect(self, model):
+        """
+        Collects the model reporters and, if due, the civilian level data.
+        """
+        for var, reporter in self.model_reporters.items():
+            self.model_vars[var].append(reporter(model))
+
+        step = model.schedule.steps
+        if self.period and step % self.period == 0:
+            self.collect_civilians(model, step)
+
+    def collect_civilians(self, model, step):
+        """
+        Records the rows of the civilians (all, or those that changed) at a step.
+        """
+        table = model.civilian_table()
+        values = np.stack([table["N_victimised"], table["stop_searched"]])
+        if self.on_change:
+            if self.last_values is None:
+                changed = np.ones(values.shape[1], dtype=bool)
+            else:
+                changed = (values != self.last_values).any(axis=0)
+            self.last_values = values
+            table = {name: column[changed] for name, column in table.items()}
+
+        columns = {
+            "Step": np.full(len(table["unique_id"]), step, dtype=np.int64),
+            "AgentID": table["unique_id"],
+            "Ethnicity": table["ethnicity"],
+            "zone": table["zone"],
+            "N_victimised": table["N_victimised"],
+            "N_stop_searched": table["stop_searched"],
+        }
+        if self.path is None:
+            self._agent_records[step] = list(zip(*(columns[name].tolist() for name in columns)))
+        else:
+            self.buffer.append(columns)
+            self.buffered_rows += len(columns["Step"])
+            if self.buffered_rows >= self.chunk_rows:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered civilian rows to disk as one chunk.
+        """
+        if self.path is None or not self.buffer:
+            return
+        chunk = {name: np.concatenate([columns[name] for columns in self.buffer]) for name in self.buffer[0]}
+        file_name = os.path.join(self.path, "agents_{:05d}.{}".format(self.n_chunks, self.fmt))
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table(chunk), file_name)
+        else:
+            np.savez_compressed(file_name, **chunk)
+        self.n_chunks += 1
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def close(self):
+        """
+        Writes the remaining civilian rows and the model reporters to disk.
+        """
+        if self.path is None:
+            return
+        self.flush()
+        np.savez_compressed(
+            os.path.join(self.path, "model.npz"),
+            **{var: np.asarray(values) for var, values in self.model_vars.items()})
+
+
+def load_agent_records(path):
+    """
+    Reads the civilian level chunks written by a StreamingDataCollector into one DataFrame.
+    """
+    import pandas as pd
+
+    frames = []
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.startswith("agents_"):
+            continue
+        full_name = os.path.join(path, file_name)
+        if file_name.endswith(".parquet"):
+            frames.append(pd.read_parquet(full_name))
+        else:
+            with np.load(full_name) as chunk:
+                frames.append(pd.DataFrame({name: chunk[name] for name in chunk.files}))
+    if not frames:
+        return pd.DataFrame(columns=["Step", "AgentID"] + list(AGENT_COLUMNS))
+    return pd.concat(frames, ignore_index=True)
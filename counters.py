@@ -0,0 +1,34 @@
+from collections import Counter
+
+
+#----------------------------------------------------------------
+class GroupedCounter:
+    """
+    A running count of incidents (victimisations or stop and searches) with breakdowns by the
+    zone and ethnicity of the civilian and the map section (grid_nr) where it happened.
+    """
+    def __init__(self):
+        self.total = 0
+        self.by_zone = Counter()
+        self.by_ethnicity = Counter()
+        self.by_grid_nr = Counter()
+
+    def add(self, zone, ethnicity, grid_nr):
+        """
+        Counts one incident.
+        """
+        self.total += 1
+        self.by_zone[int(zone)] += 1
+        self.by_ethnicity[ethnicity] += 1
+        self.by_grid_nr[int(grid_nr)] += 1
+
+    def as_dict(self):
+        """
+        Returns the counts as a dictionary.
+        """
+        return {
+            "total": self.total,
+            "by_zone": dict(self.by_zone),
+            "by_ethnicity": dict(self.by_ethnicity),
+            "by_grid_nr": dict(self.by_grid_nr),
+        }
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+#----------------------------------------------------------------
+class CopCoverage:
+    """
+    Keeps track of where the cops are and which cells they can see.
+
+    cop_count holds the number of cops on each cell and cover holds, for each cell, the number
+    of cops within the vision radius (manhattan distance 1 to vision, the cop's own cell excluded).
+    Both are updated when a cop is placed or moves, so asking if a cop is nearby is one lookup.
+    """
+    def __init__(self, width, height, vision):
+        """
+        Creates empty count and coverage grids and the diamond shaped vision kernel.
+        """
+        self.width = width
+        self.height = height
+        self.vision = vision
+        self.cop_count = np.zeros((width, height), dtype=np.int32)
+        self.cover = np.zeros((width, height), dtype=np.int32)
+
+        offsets = np.arange(-vision, vision + 1)
+        dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+        self.kernel = ((np.abs(dx) + np.abs(dy)) <= vision).astype(np.int32)
+        self.kernel[vision, vision] = 0
+
+    def _stamp(self, pos, sign):
+        """
+        Adds (sign = 1) or removes (sign = -1) the vision kernel of a cop at pos.
+        """
+        x, y = pos
+        r = self.vision
+        x0, x1 = max(x - r, 0), min(x + r + 1, self.width)
+        y0, y1 = max(y - r, 0), min(y + r + 1, self.height)
+        kernel = self.kernel[x0 - x + r:x1 - x + r, y0 - y + r:y1 - y + r]
+        if sign > 0:
+            self.cover[x0:x1, y0:y1] += kernel
+        else:
+            self.cover[x0:x1, y0:y1] -= kernel
+        self.cop_count[x, y] += sign
+
+    def add(self, pos):
+        """
+        Registers a cop at pos.
+        """
+        self._stamp(pos, 1)
+
+    def remove(self, pos):
+        """
+        Unregisters a cop at pos.
+        """
+        self._stamp(pos, -1)
+
+    def move(self, old_pos, new_pos):
+        """
+        Moves a cop from old_pos to new_pos.
+        """
+        if old_pos != new_pos:
+            self._stamp(old_pos, -1)
+            self._stamp(new_pos, 1)
+
+    def cop_nearby(self, pos):
+        """
+        Returns True if any cop can see the cell.
+        """
+        return self.cover[pos] > 0
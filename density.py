@@ -0,0 +1,122 @@
+import heapq
+import numpy as np
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# The stored values are rescaled when the growth factor exp(rate * (tick - epoch)) reaches exp(RESCALE_EXPONENT).
+RESCALE_EXPONENT = 300.0
+
+# The heaps are rebuilt when they hold more than HEAP_SLACK times as many entries as cells with crime.
+HEAP_SLACK = 4
+
+
+#----------------------------------------------------------------
+class CrimeDensity:
+    """
+    A crime density surface that decays exponentially with a half life (in ticks).
+
+    Instead of decaying every cell every tick, a crime at tick t adds its weight multiplied by
+    the growth factor exp(rate * (t - epoch)) to the stored values, and the density at tick T
+    is the stored value divided by exp(rate * (T - epoch)). All cells decay at the same rate,
+    so the order of the cells never changes through decay and only the cells of a new crime
+    are touched. The stored values are rescaled (and the epoch moved) before they overflow.
+
+    The cells of each zone are kept in a max heap of (value, cell) entries. A cell gets a new
+    entry whenever its value grows and the old entries are dropped when they reach the top,
+    so the top cells of a zone are found without scanning the map.
+    """
+    def __init__(self, zones, half_life):
+        """
+        Creates an empty surface. zones is the [x, y] array of the zone of each cell.
+        """
+        self.width, self.height = zones.shape
+        self.zone = zones.ravel()
+        self.rate = np.log(2) / half_life
+        self.value = np.zeros(self.zone.size)
+        self.epoch = 0
+        self.heaps = {int(zone): [] for zone in np.unique(self.zone)}
+        self.n_entries = 0 # Entries in the heaps.
+        self.n_cells = 0 # Cells with crime.
+
+    def growth(self, tick):
+        """
+        Returns the growth factor of a tick.
+        """
+        return np.exp(self.rate * (tick - self.epoch))
+
+    def add(self, cells, tick, weight=1.0):
+        """
+        Adds the weight of a crime at a tick to cells (flat indices).
+        """
+        if self.rate * (tick - self.epoch) > RESCALE_EXPONENT:
+            self.rescale(tick)
+        self.n_cells += int(np.count_nonzero(self.value[cells] == 0))
+        self.value[cells] += weight * self.growth(tick)
+        for cell in np.asarray(cells).tolist():
+            heapq.heappush(self.heaps[int(self.zone[cell])], (-self.value[cell], cell))
+        self.n_entries += len(cells)
+        if self.n_entries > HEAP_SLACK * self.n_cells + 64:
+            self.rebuild_heaps()
+
+    def rescale(self, tick):
+        """
+        Divides the stored values by the growth factor of a tick and makes it the new epoch.
+        """
+        self.value /= self.growth(tick)
+        self.epoch = tick
+        self.rebuild_heaps()
+
+    def rebuild_heaps(self):
+        """
+        Rebuilds the heaps from the cells with crime, dropping the old entries.
+        """
+        cells = np.flatnonzero(self.value)
+        for zone in self.heaps:
+            in_zone = cells[self.zone[cells] == zone]
+            heap = list(zip((-self.value[in_zone]).tolist(), in_zone.tolist()))
+            heapq.heapify(heap)
+            self.heaps[zone] = heap
+        self.n_entries = len(cells)
+        self.n_cells = len(cells)
+
+    def density(self, tick):
+        """
+        Returns the [x, y] array of the density at a tick.
+        """
+        return (self.value / self.growth(tick)).reshape(self.width, self.height)
+
+    def at(self, pos, tick):
+        """
+        Returns the density of one cell at a tick.
+        """
+        return float(self.value[pos[0] * self.height + pos[1]] / self.growth(tick))
+
+    def zone_top(self, zone, k):
+        """
+        Returns up to k (negative stored value, cell) entries of the highest cells of a zone.
+        """
+        heap = self.heaps[zone]
+        found = []
+        seen = set()
+        while heap and len(found) < k:
+            entry = heapq.heappop(heap)
+            value, cell = -entry[0], entry[1]
+            if value != self.value[cell] or cell in seen:
+                self.n_entries -= 1 # An old entry of a cell whose value has grown since.
+                continue
+            found.append(entry)
+            seen.add(cell)
+        for entry in found:
+            heapq.heappush(heap, entry)
+        return found
+
+    def top(self, k=5, zone=None):
+        """
+        Returns the flat indices of the k cells with the highest density,
+        in the whole city or only in one zone.
+        """
+        if zone is None:
+            entries = sorted(entry for z in self.heaps for entry in self.zone_top(z, k))[:k]
+        else:
+            entries = self.zone_top(zone, k)
+        return [cell for _, cell in entries]
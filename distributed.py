@@ -0,0 +1,398 @@
+"""
+Runs the civilians of a large city in several processes, one per tile of the map.
+
+Each tile (by default one of the four zones) is a VectorEngine in its own worker process
+that owns the civilians currently on its cells. A worker keeps its occupancy, cop coverage and
+tile map only for the window of its tile: the box of the tile with the cells its civilians
+can reach in a tick and the cells its cops can see from around it. Only the layout, which the
+shortest paths to destinations beyond the window need, covers the whole city; it is written
+once and memory mapped by all workers, which search only the paths their civilians walk.
+A tick takes three exchanges with the workers:
+
+    advance     the workers make the moves of their civilians and send back the civilians
+                that left their tile, which are handed to the tile they moved into;
+    settle      the workers take in the arriving civilians (in one batch) and the cops within COP_VISION of
+                their tile (the halo), let their offenders offend and send back the robberies;
+    stopsearch  after the cops have moved, the worker owning the cell of each cop stops and
+                searches one of the civilians there.
+
+The cops stay in the model. The robberies of all tiles are recorded in the model's street
+layer, so the hot spots the cops patrol are the merged counts of the whole city. Every
+worker draws from its own random generator, so a run is reproducible for a seed and a
+tiling but does not draw the same numbers as a single engine.
+"""
+import multiprocessing
+import random
+import shutil
+import tempfile
+import weakref
+from types import SimpleNamespace
+import numpy as np
+from agent import COP_VISION
+from engine import VectorEngine, COLUMNS
+from street import StreetLayer, CellTable
+from routing import Router
+from coverage import CopCoverage
+from occupancy import Occupancy
+from layout import load_layout, save_layout
+
+
+def tile_map(streets, tiles=None):
+    """
+    Returns the [x, y] array of the tile of each cell: the zones (grid_nr 1 to n as
+    tiles 0 to n - 1) or, with tiles = (nx, ny), a grid of nx by ny equal rectangles.
+    """
+    if tiles is None:
+        return streets.grid_nr - 1
+    nx, ny = tiles
+    x_cor = np.arange(streets.width)[:, None]
+    y_cor = np.arange(streets.height)[None, :]
+    return (x_cor * nx // streets.width) * ny + (y_cor * ny // streets.height)
+
+
+def tile_boxes(tiles):
+    """
+    Returns the bounding box (x0, x1, y0, y1), inclusive, of every tile of a tile map.
+    """
+    boxes = []
+    for tile in range(int(tiles.max()) + 1):
+        xs, ys = np.nonzero(tiles == tile)
+        boxes.append((xs.min(), xs.max(), ys.min(), ys.max()))
+    return boxes
+
+
+def halo(positions, box, vision=COP_VISION):
+    """
+    Returns the positions (an array of [x, y] rows) within vision (manhattan distance) of a box.
+    """
+    if len(positions) == 0:
+        return positions
+    x0, x1, y0, y1 = box
+    x, y = positions[:, 0], positions[:, 1]
+    distance = np.maximum(np.maximum(x0 - x, x - x1), 0) + np.maximum(np.maximum(y0 - y, y - y1), 0)
+    return positions[distance <= vision]
+
+
+def merge_batches(batches):
+    """
+    Returns the civilians of several batches (arrays of VectorEngine.take) as one batch, in
+    the order of the batches, or None if there are no batches.
+    """
+    if not batches:
+        return None
+    return {name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]}
+
+
+#----------------------------------------------------------------
+class TileWindow:
+    """
+    The cells a worker keeps arrays for: the box of its tile and the cells within reach of it
+    along each axis, on the map. Cells of the map are flat indices of the map, cells of the
+    window flat indices of the window.
+    """
+    def __init__(self, box, reach, width, height):
+        x0, x1, y0, y1 = box
+        self.x0, self.x1 = max(x0 - reach, 0), min(x1 + reach, width - 1)
+        self.y0, self.y1 = max(y0 - reach, 0), min(y1 + reach, height - 1)
+        self.width = self.x1 - self.x0 + 1
+        self.height = self.y1 - self.y0 + 1
+        self.map_height = height
+
+    def local(self, cells):
+        """
+        Returns the cells of the window of cells of the map.
+        """
+        x, y = np.divmod(cells, self.map_height)
+        return (x - self.x0) * self.height + (y - self.y0)
+
+    def crop(self, grid):
+        """
+        Returns the part of an [x, y] array of the map in the window.
+        """
+        return grid[self.x0:self.x1 + 1, self.y0:self.y1 + 1]
+
+
+#----------------------------------------------------------------
+class TileOccupancy(Occupancy):
+    """
+    The occupancy of the cells of a window, for the flat cell indices of the map.
+    """
+    def __init__(self, window):
+        super().__init__(window.width, window.height)
+        self.window = window
+
+    def load(self, cells):
+        super().load(self.window.local(cells))
+
+    def move_many(self, old_cells, new_cells):
+        super().move_many(self.window.local(old_cells), self.window.local(new_cells))
+
+    def crowded(self, cells, min_count=2):
+        return super().crowded(self.window.local(cells), min_count)
+
+
+#----------------------------------------------------------------
+class TileCoverage(CopCoverage):
+    """
+    The cop coverage of the cells of a window, for positions on the map. The cops must be in the window.
+    """
+    def __init__(self, window, vision):
+        super().__init__(window.width, window.height, vision)
+        self.window = window
+
+    def _stamp(self, pos, sign):
+        super()._stamp((pos[0] - self.window.x0, pos[1] - self.window.y0), sign)
+
+    def cop_nearby(self, pos):
+        return self.cover[pos[0] - self.window.x0, pos[1] - self.window.y0] > 0
+
+
+#----------------------------------------------------------------
+class IncidentLog:
+    """
+    Stands in for a GroupedCounter in a worker and keeps the incidents until they are sent.
+    """
+    def __init__(self):
+        self.records = []
+
+    def add(self, zone, ethnicity, grid_nr):
+        self.records.append((int(zone), ethnicity, int(grid_nr)))
+
+    def pop(self):
+        records, self.records = self.records, []
+        return records
+
+
+#----------------------------------------------------------------
+class TileStreets(StreetLayer):
+    """
+    The street layer of a worker, with only the arrays of the layout that the engine and
+    the router read. Robberies are kept until they are sent, as the crime counts and
+    hot spots are kept by the model.
+    """
+    def __init__(self, layout):
+        self.layout = layout
+        self.width = layout.width
+        self.height = layout.height
+        self.cells = CellTable(self.width, self.height)
+        self.road = layout.road
+        self.risk = layout.risk
+        self.grid_nr = layout.zones
+        self.recorded = []
+
+    def record_crime(self, pos, radius=2, tick=0):
+        self.recorded.append((pos, radius, tick))
+
+    def pop(self):
+        recorded, self.recorded = self.recorded, []
+        return recorded
+
+
+#----------------------------------------------------------------
+class TileModel:
+    """
+    The parts of Map that a VectorEngine uses, for the civilians of one tile.
+    """
+    def __init__(self, layout, window, seed):
+        self.random = random.Random(seed)
+        self.schedule = SimpleNamespace(steps=0)
+        self.window = window
+        self.streets = TileStreets(layout)
+        self.router = Router(self.streets)
+        self.cop_coverage = TileCoverage(window, COP_VISION)
+        self.occupancy = TileOccupancy(window)
+        self.victimisations = IncidentLog()
+        self.stop_searches = IncidentLog()
+
+    def place_cops(self, positions):
+        """
+        Replaces the cops of the coverage by the cops at positions.
+        """
+        self.cop_coverage = TileCoverage(self.window, COP_VISION)
+        for x, y in positions.tolist():
+            self.cop_coverage.add((x, y))
+
+
+def tile_worker(conn, tile, setup):
+    """
+    Runs the civilians of one tile, answering the commands of a DistributedEngine on conn.
+    """
+    layout, window = load_layout(setup["layout"]), setup["window"]
+    model = TileModel(layout, window, setup["seed"])
+    engine = VectorEngine(model, layout.width, layout.height)
+    engine.load(setup["population"], setup["destinations"])
+    tiles = setup["tiles"].ravel() # The tiles of the cells of the window.
+
+    while True:
+        command, *args = conn.recv()
+        if command == "advance":
+            engine.advance()
+            owner = tiles[window.local(engine.pos)]
+            leaving = np.flatnonzero(owner != tile)
+            taken = engine.take(leaving)
+            owner = owner[leaving]
+            conn.send({int(t): {name: rows[owner == t] for name, rows in taken.items()} for t in np.unique(owner)})
+        elif command == "settle":
+            arriving, cops, tick = args
+            if arriving is not None:
+                engine.put(arriving)
+            model.place_cops(cops)
+            model.schedule.steps = tick
+            engine.settle()
+            conn.send((model.streets.pop(), model.victimisations.pop()))
+        elif command == "stopsearch":
+            for flat in args[0]:
+                engine.stopsearch(flat)
+            conn.send(model.stop_searches.pop())
+        elif command == "table":
+            conn.send(engine.civilian_table())
+        elif command == "close":
+            conn.close()
+            return
+
+
+def stop_workers(conns, workers, layout_dir):
+    """
+    Asks the workers to stop, waits for them and removes the layout files they mapped. Called by
+    DistributedEngine.close, or when an engine that was not closed is garbage collected or the interpreter exits.
+    """
+    for conn in conns:
+        try:
+            conn.send(("close",))
+            conn.close()
+        except (OSError, ValueError):
+            pass # The worker or the pipe is already gone.
+    for worker in workers:
+        worker.join()
+    conns.clear()
+    workers.clear()
+    shutil.rmtree(layout_dir, ignore_errors=True)
+
+
+#----------------------------------------------------------------
+class DistributedEngine:
+    """
+    Keeps the civilians in worker processes, one per tile, with the interface of VectorEngine
+    that Map uses. Cops ask for stop and searches with request_stopsearch, which are made
+    when the model calls stopsearch after all cops have moved.
+    """
+    remote = True # The civilians are in other processes.
+
+    def __init__(self, model, width, height, tiles=None):
+        """
+        Creates the tiles. The workers are started by load.
+        """
+        self.model = model
+        self.width = width
+        self.height = height
+        self.tiles = tile_map(model.streets, tiles)
+        self.boxes = tile_boxes(self.tiles)
+        self.conns = []
+        self.workers = []
+        self.requests = []
+        self.final_table = None # The civilian table once the workers are stopped.
+        self.layout_dir = tempfile.mkdtemp(prefix="layout-") # The layout mapped by the workers.
+        self.stopper = weakref.finalize(self, stop_workers, self.conns, self.workers, self.layout_dir)
+
+    def __getstate__(self):
+        raise TypeError("A model with a distributed engine cannot be pickled")
+
+    def load(self, population):
+        """
+        Hands the civilians to the workers of the tiles of their homes and starts the workers.
+        """
+        nodes = np.asarray(population["nodes"], dtype=np.int64)
+        home = np.asarray(population["home"], dtype=np.int64)
+        destinations = np.unique(np.concatenate([home, nodes.ravel()]))
+        owner = self.tiles.ravel()[home]
+        # The window of a tile reaches as far as a civilian moves in a tick and a cop sees.
+        moves = int(np.ceil(np.max(population["travel_speed"], initial=0))) if "travel_speed" in population else 0
+        reach = max(moves, COP_VISION)
+        save_layout(self.model.layout, self.layout_dir)
+        context = multiprocessing.get_context()
+        for tile in range(len(self.boxes)):
+            mine = owner == tile
+            window = TileWindow(self.boxes[tile], reach, self.width, self.height)
+            setup = {
+                "layout": self.layout_dir,
+                "window": window,
+                "seed": self.model.random.getrandbits(64),
+                "tiles": window.crop(self.tiles),
+                "destinations": destinations,
+                "population": {name: np.asarray(population[name])[mine]
+                    for name in list(COLUMNS) + ["nodes"] if name in population},
+            }
+            conn, child = context.Pipe()
+            worker = context.Process(target=tile_worker, args=(child, tile, setup), daemon=True)
+            worker.start()
+            child.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def step(self):
+        """
+        A single tick for all civilians.
+        """
+        for conn in self.conns:
+            conn.send(("advance",))
+        leaving = [conn.recv() for conn in self.conns]
+
+        cops = np.array([cop.pos for cop in self.model.cops], dtype=np.int64).reshape(-1, 2)
+        tick = self.model.schedule.steps
+        for tile, conn in enumerate(self.conns):
+            arriving = merge_batches([moved[tile] for moved in leaving if tile in moved])
+            conn.send(("settle", arriving, halo(cops, self.boxes[tile]), tick))
+
+        # Merge the robberies of all tiles, in tile order.
+        for conn in self.conns:
+            crimes, victimisations = conn.recv()
+            for pos, radius, crime_tick in crimes:
+                self.model.streets.record_crime(pos, radius=radius, tick=crime_tick)
+            for record in victimisations:
+                self.model.victimisations.add(*record)
+
+    def request_stopsearch(self, pos):
+        """
+        Asks for a stop and search by a cop at pos.
+        """
+        self.requests.append(pos[0] * self.height + pos[1])
+
+    def stopsearch(self):
+        """
+        Makes the requested stop and searches in the workers owning the cells.
+        """
+        if not self.requests:
+            return
+        requests = np.array(self.requests, dtype=np.int64)
+        owner = self.tiles.ravel()[requests]
+        self.requests = []
+        asked = []
+        for tile, conn in enumerate(self.conns):
+            cells = requests[owner == tile]
+            if len(cells) > 0:
+                conn.send(("stopsearch", cells.tolist()))
+                asked.append(conn)
+        for conn in asked:
+            for record in conn.recv():
+                self.model.stop_searches.add(*record)
+
+    def civilian_table(self):
+        """
+        Returns the civilian level data of all tiles as arrays, in order of unique_id.
+        """
+        if self.final_table is not None:
+            return self.final_table
+        for conn in self.conns:
+            conn.send(("table",))
+        tables = [conn.recv() for conn in self.conns]
+        table = {name: np.concatenate([t[name] for t in tables]) for name in tables[0]}
+        order = np.argsort(table["unique_id"], kind="stable")
+        return {name: column[order] for name, column in table.items()}
+
+    def close(self):
+        """
+        Keeps the civilian table and stops the workers.
+        """
+        if self.conns:
+            self.final_table = self.civilian_table()
+        self.stopper()
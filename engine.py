@@ -0,0 +1,431 @@
+import numpy as np
+from agent import ROBBERY_RATE, WHITE_STOP, OTHER_STOP, ASIAN_STOP, BLACK_STOP
+from agent import WHITE_THRESHOLD, OTHER_THRESHOLD, ASIAN_THRESHOLD, BLACK_THRESHOLD
+from street import NO_ROAD_RISK
+from population import ETHNICITIES
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Movement states of the civilians, stored as small integers.
+MOVING = 0
+ARRIVED = 1
+WAITING = 2
+STATES = ("moving", "arrived", "waiting")
+
+# Columns of the civilian arrays and their types.
+COLUMNS = {
+    "unique_id": np.int64,
+    "pos": np.int64,
+    "prev_pos": np.int64,
+    "home": np.int64,
+    "state": np.uint8,
+    "timer": np.int32,
+    "travel_speed": np.float64,
+    "criminal_propensity": np.int16,
+    "chronic_offender": np.bool_,
+    "time_to_offending": np.float64,
+    "victimisation": np.int16,
+    "attractiveness": np.float64,
+    "perceived_guardianship": np.float64,
+    "perceived_capability": np.float64,
+    "N_victimised": np.int32,
+    "ethnicity": np.uint8,
+    "zone": np.int16,
+    "stop_searched": np.int32,
+    "replicate": np.int32,
+}
+
+# All per civilian arrays of the engine, moved together when civilians leave or join an engine.
+ROW_ARRAYS = tuple(COLUMNS) + ("offend_score", "n_moves", "home_row", "node_rows", "dest_row")
+
+# Ethnic appearance and threshold of stop and search, indexed by ethnicity code.
+STOP_APPEARANCE = np.array([{"white": WHITE_STOP, "other": OTHER_STOP, "asian": ASIAN_STOP, "black": BLACK_STOP}[e]
+    for e in ETHNICITIES])
+STOP_THRESHOLD = np.array([{"white": WHITE_THRESHOLD, "other": OTHER_THRESHOLD, "asian": ASIAN_THRESHOLD,
+    "black": BLACK_THRESHOLD}[e] for e in ETHNICITIES])
+
+
+def _array_property(name, convert):
+    """
+    Creates a property that reads and writes one element of an engine array.
+    """
+    def getter(self):
+        return convert(getattr(self.engine, name)[self.index])
+
+    def setter(self, value):
+        getattr(self.engine, name)[self.index] = value
+
+    return property(getter, setter)
+
+
+#----------------------------------------------------------------
+class CivilianView:
+    """
+    A thin view of one civilian of the vectorised engine. It has the attribute names of
+    Civilian so that reporters, cops and the visualisation can treat it as an agent.
+    """
+    typ = "civilian"
+
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.model = engine.model
+        self.index = index
+        self.unique_id = int(engine.unique_id[index])
+
+    pos = property(lambda self: self.engine.cell(self.engine.pos[self.index]))
+    home = property(lambda self: self.engine.cell(self.engine.home[self.index]))
+    prev_pos = property(lambda self: self.engine.cell(self.engine.prev_pos[self.index]))
+    moving = property(lambda self: STATES[self.engine.state[self.index]])
+    ethnicity = property(lambda self: ETHNICITIES[self.engine.ethnicity[self.index]])
+
+    @property
+    def destination(self):
+        row = self.engine.dest_row[self.index]
+        if row < 0:
+            return []
+        return self.engine.cell(self.engine.destinations[row])
+
+    @property
+    def activity_nodes(self):
+        return [self.engine.cell(self.engine.destinations[row]) for row in self.engine.node_rows[self.index]]
+
+    timer = _array_property("timer", int)
+    travel_speed = _array_property("travel_speed", float)
+    criminal_propensity = _array_property("criminal_propensity", int)
+    chronic_offender = _array_property("chronic_offender", bool)
+    time_to_offending = _array_property("time_to_offending", float)
+    victimisation = _array_property("victimisation", int)
+    attractiveness = _array_property("attractiveness", float)
+    perceived_guardianship = _array_property("perceived_guardianship", float)
+    perceived_capability = _array_property("perceived_capability", float)
+    N_victimised = _array_property("N_victimised", int)
+    zone = _array_property("zone", int)
+    stop_searched = _array_property("stop_searched", int)
+    offend_score = _array_property("offend_score", float)
+
+
+#----------------------------------------------------------------
+class VectorEngine:
+    """
+    Stores the state of all civilians in NumPy arrays (one element per civilian) and
+    advances their movement, timers and offending for the whole population at once.
+
+    Each tick follows the rules of Civilian.step: waiting timers count down, every civilian
+    makes ceil(travel_speed) moves, and then offenders look for victims in their cell.
+    The civilians are not placed on the grid or in the scheduler; cops and reporters
+    reach them through civilians_at and views.
+
+    An engine can also hold the civilians of several models (the replicates of an ensemble,
+    see ensemble.py), in contiguous blocks by replicate. Each replicate has its own random
+    generator, counters, cops and crime counts, and its cells are keyed apart (the key of a
+    cell is replicate * cells + flat index), so the replicates never meet.
+    """
+    remote = False # The civilians are in this process.
+
+    def __init__(self, model, width, height):
+        """
+        Creates an empty engine. The civilians are added with load.
+        """
+        self.model = model
+        self.width = width
+        self.height = height
+        self.n_cells = width * height
+        self.rng = np.random.default_rng(model.random.getrandbits(64))
+        self.models = [model] # The model of each replicate.
+        self.rngs = [self.rng] # The random generator of each replicate.
+        self._views = {}
+
+    def __getstate__(self):
+        """
+        Leaves the views out of pickles (checkpoints).
+        """
+        state = self.__dict__.copy()
+        state["_views"] = {}
+        return state
+
+    def flat(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def cell(self, flat):
+        x, y = divmod(int(flat), self.height)
+        return (x, y)
+
+    def load(self, population, destinations=None):
+        """
+        Takes the civilians from the arrays of synthesise_population, all moving from home.
+        destinations (sorted flat cells) can be given to share the destination rows (home_row,
+        node_rows, dest_row) with other engines; it must hold every home and activity node of the population.
+        """
+        n = len(population["home"])
+        for name, dtype in COLUMNS.items():
+            if name in population:
+                setattr(self, name, np.asarray(population[name], dtype=dtype))
+            else:
+                setattr(self, name, np.zeros(n, dtype=dtype))
+        self.pos = self.home.copy()
+        self.prev_pos = self.home.copy()
+        self.state[:] = MOVING
+        nodes = np.asarray(population["nodes"], dtype=np.int64)
+        self.n = n
+        self.offend_score = np.zeros(self.n)
+        self.n_moves = np.ceil(self.travel_speed).astype(np.int16)
+
+        # Every destination (home or activity node) gets a row, by which the civilians refer to it.
+        if destinations is None:
+            destinations = np.unique(np.concatenate([self.home, nodes.ravel()]))
+        self.destinations = np.asarray(destinations, dtype=np.int64)
+        self.home_row = np.searchsorted(self.destinations, self.home)
+        self.node_rows = np.searchsorted(self.destinations, nodes)
+        self.dest_row = np.full(self.n, -1, dtype=np.int64)
+
+        self.offender_rows = np.flatnonzero(self.criminal_propensity > 0)
+        self.model.occupancy.load(self.keys())
+        self.index_cells()
+
+    def keys(self):
+        """
+        Returns the cell key of every civilian: its flat cell index, offset by its replicate.
+        """
+        if len(self.models) == 1:
+            return self.pos
+        return self.replicate.astype(np.int64) * self.n_cells + self.pos
+
+    def groups(self, idx):
+        """
+        Splits sorted civilian indices by replicate. Returns (replicate, indices) pairs.
+        """
+        if len(self.models) == 1:
+            return [(0, idx)]
+        bounds = np.searchsorted(self.replicate[idx], np.arange(len(self.models) + 1))
+        return [(r, idx[bounds[r]:bounds[r + 1]]) for r in range(len(self.models))]
+
+    def draw(self, idx, method, *args):
+        """
+        Draws one number for every civilian of the sorted indices idx with a method of the
+        random generators ("integers" or "uniform"), from the generator of its replicate.
+        """
+        if len(self.models) == 1:
+            return getattr(self.rng, method)(*args, len(idx))
+        return np.concatenate([getattr(self.rngs[r], method)(*args, len(group)) for r, group in self.groups(idx)])
+
+    def next_cells(self, idx, cells):
+        """
+        Returns the next cell on the shortest path of each civilian (sorted indices idx) from its
+        cell to its destination, or its cell where the destination cannot be reached, found by
+        the router of its replicate.
+        """
+        targets = self.current_destination(idx)
+        steps = []
+        start = 0
+        for r, group in self.groups(idx):
+            part = slice(start, start + len(group))
+            steps += self.models[r].router.next_cells(cells[part].tolist(), targets[part].tolist())
+            start += len(group)
+        return np.array(steps, dtype=np.int64)
+
+    def current_destination(self, idx):
+        rows = self.dest_row[idx]
+        return np.where(rows >= 0, self.destinations[rows], -1)
+
+    def move(self, active):
+        """
+        One move of every active civilian, following the states of Civilian.move.
+        """
+        moving = np.flatnonzero(active & (self.state == MOVING))
+        arrived = np.flatnonzero(active & (self.state == ARRIVED))
+        woken = np.flatnonzero(active & (self.state == WAITING) & (self.timer == 0))
+
+        if len(moving) > 0:
+            # Select a new destination at home or at the current destination.
+            pos = self.pos[moving]
+            at_home = pos == self.home[moving]
+            at_dest = ~at_home & (pos == self.current_destination(moving))
+            other_node = at_dest & (self.draw(moving, "integers", 0, 101) > 79) # 80% chance of returning home
+            pick = self.node_rows[moving, self.draw(moving, "integers", 0, self.node_rows.shape[1])]
+            new_node = at_home | other_node
+            self.dest_row[moving[new_node]] = pick[new_node]
+            to_home = at_dest & ~other_node
+            self.dest_row[moving[to_home]] = self.home_row[moving[to_home]]
+
+            # Take the next step on the shortest path to the destination.
+            dest = self.current_destination(moving)
+            going = pos != dest
+            walkers = moving[going]
+            steps = self.next_cells(walkers, pos[going])
+            stepping = steps != pos[going]
+            self.prev_pos[walkers[stepping]] = pos[going][stepping]
+            self.pos[walkers] = steps
+
+            # Check if the civilians have arrived.
+            self.state[moving[self.pos[moving] == dest]] = ARRIVED
+
+        if len(arrived) > 0:
+            self.prev_pos[arrived] = self.pos[arrived]
+            self.state[arrived] = WAITING
+            at_home = self.pos[arrived] == self.home[arrived]
+            home_timer = 1 + self.draw(arrived, "uniform", 0, 600).astype(np.int32) # Home Node = 1 tick + U(0, 600)
+            node_timer = 15 + self.draw(arrived, "uniform", 0, 480).astype(np.int32) # Activity Node = 15 ticks + U(0, 480)
+            self.timer[arrived] = np.where(at_home, home_timer, node_timer)
+
+        self.state[woken] = MOVING
+
+    def index_cells(self):
+        """
+        Sorts the civilians by cell key so that the civilians on a cell can be found quickly.
+        """
+        keys = self.keys()
+        self.cell_order = np.argsort(keys, kind="stable")
+        self.sorted_pos = keys[self.cell_order]
+
+    def members(self, flat):
+        """
+        Returns the indices of the civilians on a cell (cell key: the flat index with one replicate).
+        """
+        lo, hi = np.searchsorted(self.sorted_pos, [flat, flat + 1])
+        return self.cell_order[lo:hi]
+
+    def civilians_at(self, pos):
+        """
+        Returns the views of the civilians on a cell.
+        """
+        return [self.view(i) for i in self.members(self.flat(pos))]
+
+    def offend(self):
+        """
+        Offenders on a cell with other civilians decide whether to rob one of them,
+        following the rational choice rules of Civilian.offend.
+        """
+        rows = self.offender_rows
+        eligible = rows[(self.state[rows] == MOVING) & (self.time_to_offending[rows] >= 0)]
+        keys = self.keys()
+        offenders = eligible[self.model.occupancy.crowded(keys[eligible])]
+        tick = self.model.schedule.steps
+
+        for r, group in self.groups(offenders):
+            model, rng = self.models[r], self.rngs[r]
+            streets = model.streets
+            for i in rng.permutation(group):
+                pos = self.cell(self.pos[i])
+                same_cell = self.members(keys[i])
+                others = same_cell[same_cell != i]
+                victim = others[rng.integers(len(others))]
+                if model.cop_coverage.cop_nearby(pos):
+                    continue
+                road_risk = streets.road_risk(pos)
+                if road_risk < NO_ROAD_RISK:
+                    Nc = (len(same_cell) - 2) + self.perceived_guardianship[victim]
+                    guardianship = self.perceived_capability[i] + Nc
+                    rational_choice_score = self.attractiveness[victim] - guardianship + self.criminal_propensity[i] + road_risk
+                    self.offend_score[i] = rational_choice_score
+                    if rational_choice_score >= ROBBERY_RATE:
+                        self.N_victimised[victim] += 1
+                        model.victimisations.add(self.zone[victim], ETHNICITIES[self.ethnicity[victim]], streets.grid_nr[pos])
+                        if self.criminal_propensity[i] < 20:
+                            self.time_to_offending[i] = round(rng.uniform(0, 43200)) # 0 to 30 days.
+                            streets.record_crime(pos, radius=2, tick=tick)
+
+    def stopsearch(self, flat):
+        """
+        A cop on a cell (cell key) stops and searches one of the civilians there,
+        following the rules of Cop.stopsearch.
+        """
+        same_cell = self.members(flat)
+        if len(same_cell) < 2:
+            return # Too few civilians on the cell.
+        r, flat = divmod(int(flat), self.n_cells)
+        model = self.models[r]
+        suspect = same_cell[self.rngs[r].integers(len(same_cell))]
+        ethnicity = self.ethnicity[suspect]
+        if self.attractiveness[suspect] + STOP_APPEARANCE[ethnicity] >= STOP_THRESHOLD[ethnicity]:
+            self.stop_searched[suspect] += 1
+            model.stop_searches.add(self.zone[suspect], ETHNICITIES[ethnicity], model.streets.grid_nr.flat[flat])
+
+    def advance(self):
+        """
+        Counts down the timers and makes the moves of all civilians.
+        Returns the cell keys of the civilians before the moves.
+        """
+        self.timer[self.state == WAITING] -= 1 # Countdown timer
+        start = self.keys().copy()
+        for k in range(int(self.n_moves.max(initial=0))):
+            self.move(self.n_moves > k)
+        return start
+
+    def settle(self, start=None):
+        """
+        Updates the occupancy (from the cell keys before the moves, if given) and the cell index,
+        and lets the offenders offend.
+        """
+        if start is not None:
+            self.model.occupancy.move_many(start, self.keys())
+        self.index_cells()
+
+        # Calculate if civilians will offend.
+        self.offend()
+        rows = self.offender_rows
+        self.time_to_offending[rows[self.criminal_propensity[rows] < 10]] -= 1
+
+    def step(self):
+        """
+        A single tick for all civilians.
+        """
+        self.settle(self.advance())
+
+    def take(self, rows):
+        """
+        Removes civilians (indices) from the engine and returns their arrays, to be put into another engine.
+        """
+        keep = np.ones(self.n, dtype=bool)
+        keep[rows] = False
+        taken = {name: getattr(self, name)[rows] for name in ROW_ARRAYS}
+        for name in ROW_ARRAYS:
+            setattr(self, name, getattr(self, name)[keep])
+        self.reindex()
+        return taken
+
+    def put(self, taken):
+        """
+        Adds the civilians taken from another engine with the same destinations.
+        """
+        for name in ROW_ARRAYS:
+            setattr(self, name, np.concatenate([getattr(self, name), taken[name]]))
+        self.reindex()
+
+    def reindex(self):
+        """
+        Updates the size, offenders, occupancy and cell index after civilians left or joined.
+        """
+        self.n = len(self.unique_id)
+        self._views = {}
+        self.offender_rows = np.flatnonzero(self.criminal_propensity > 0)
+        self.model.occupancy.load(self.keys())
+        self.index_cells()
+
+    def civilian_table(self, rows=slice(None)):
+        """
+        Returns the civilian level data as arrays, as Map.civilian_table, of all civilians
+        or of the rows (a slice or indices).
+        """
+        return {
+            "unique_id": self.unique_id[rows].copy(),
+            "ethnicity": np.array(ETHNICITIES)[self.ethnicity[rows]],
+            "zone": self.zone[rows].astype(np.int64),
+            "N_victimised": self.N_victimised[rows].copy(),
+            "stop_searched": self.stop_searched[rows].copy(),
+        }
+
+    def view(self, index):
+        """
+        Returns the view of one civilian.
+        """
+        view = self._views.get(index)
+        if view is None:
+            view = CivilianView(self, index)
+            self._views[index] = view
+        return view
+
+    def views(self):
+        """
+        Returns the views of all civilians.
+        """
+        return [self.view(i) for i in range(self.n)]
@@ -0,0 +1,202 @@
+"""
+Runs many replicates of one model configuration in lockstep, in a single VectorEngine.
+
+Every replicate is a Map with its own seed, cops, counters, crime counts and data collector,
+but the civilians of all replicates are rows of one engine, blocks of it by replicate, so a
+tick moves the civilians of all replicates with one set of array operations. The replicates
+share the city: the layout (with one risk surface, drawn from the ensemble's seed), the street
+arrays, zone indexes and node pools. Each replicate finds its own paths, as the paths found
+depend on the walks made before.
+
+Each replicate draws from its own random generators, in the order of a single model, so
+replicate r gives the same results as Map(..., vectorised=True, layout=ensemble.layout, seed=seeds[r]).
+"""
+import random
+import numpy as np
+from model import Map, RUN_LENGTH
+from engine import VectorEngine
+from street import StreetLayer
+from occupancy import Occupancy
+from layout import grid_layout, load_layout
+from population import truncated_poisson
+from profiling import PhaseProfiler
+
+
+def replicate_seeds(seed, R):
+    """
+    Returns the seeds of R replicates, derived from the seed of the ensemble.
+    """
+    return [int(s) for s in np.random.SeedSequence(seed).generate_state(R, dtype=np.uint64)]
+
+
+#----------------------------------------------------------------
+class ReplicateEngine:
+    """
+    The engine of one replicate: its block of the civilians of the ensemble's engine,
+    with the interface of VectorEngine that Map uses. The block is filled when the
+    ensemble loads the populations of all replicates.
+    """
+    remote = False # The civilians are in this process.
+
+    def __init__(self, ensemble, index):
+        self.ensemble = ensemble
+        self.index = index
+        self.offset = index * ensemble.engine.n_cells # Cell keys of the replicate start here.
+        self.rows = slice(0, 0) # Rows of the civilians in the ensemble's engine.
+
+    def load(self, population):
+        """
+        Hands the population to the ensemble, which loads all replicates at once.
+        """
+        self.ensemble.populations.append(population)
+
+    def step(self):
+        raise RuntimeError("The replicates of an ensemble are stepped by Ensemble.step")
+
+    def civilians_at(self, pos):
+        """
+        Returns the views of the civilians of the replicate on a cell.
+        """
+        engine = self.ensemble.engine
+        return [engine.view(i) for i in engine.members(self.offset + engine.flat(pos))]
+
+    def civilian_table(self):
+        """
+        Returns the civilian level data of the replicate as arrays, as Map.civilian_table.
+        """
+        return self.ensemble.engine.civilian_table(self.rows)
+
+    def views(self):
+        """
+        Returns the views of the civilians of the replicate.
+        """
+        engine = self.ensemble.engine
+        return [engine.view(i) for i in range(self.rows.start, self.rows.stop)]
+
+
+#----------------------------------------------------------------
+class Ensemble:
+    """
+    R replicates of one model configuration on the same city, advanced together.
+    The replicates are the Maps in models; their series are read with series.
+    """
+    def __init__(self, R, N, NC, width, height, N_strategic_cops, ethnic_distribution, zonal_hotspots=False,
+    collect_period=None, seed=None, seeds=None, crime_half_life=None, layout=None, profile=False):
+        # seeds are the seeds of the replicates; without them they are derived from seed.
+        # layout is a Layout or the directory of its files, as for Map.
+        # With profile, the phases of all replicates are timed together, a tick per Ensemble.step.
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
+        if seeds is None:
+            seeds = replicate_seeds(seed, R)
+        if len(seeds) != R:
+            raise ValueError("An ensemble of {} replicates needs {} seeds".format(R, R))
+        self.seeds = list(seeds)
+        self.running = True
+
+        # The city shared by all replicates.
+        #----------------------------------------------------------------
+        if isinstance(layout, str):
+            layout = load_layout(layout)
+        if layout is None:
+            layout = grid_layout(width, height)
+        width, height = layout.width, layout.height
+        if layout.risk is None:
+            layout = layout.with_risk(truncated_poisson(self.rng, 0.19, 6, width * height))
+        self.layout = layout
+        self.width = width
+        self.height = height
+        self.streets = StreetLayer(layout, crime_half_life=crime_half_life)
+
+        # The civilians of all replicates, with the cells of replicate r in columns r * width to (r + 1) * width of the occupancy.
+        self.occupancy = Occupancy(R * width, height)
+        self.engine = VectorEngine(self, width, height)
+        self.engine.models = []
+        self.engine.rngs = []
+
+        # The replicates.
+        #----------------------------------------------------------------
+        self.populations = []
+        self.models = []
+        for replicate_seed in self.seeds:
+            self.models.append(Map(N, NC, width, height, N_strategic_cops, ethnic_distribution,
+                zonal_hotspots=zonal_hotspots, vectorised=True, collect_period=collect_period,
+                seed=replicate_seed, crime_half_life=crime_half_life, ensemble=self))
+        self.load_populations()
+        self.profiler = PhaseProfiler() if profile else None
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    @property
+    def schedule(self):
+        """
+        The scheduler of the first replicate, whose step count is that of all replicates.
+        """
+        return self.models[0].schedule
+
+    def add_replicate(self, model):
+        """
+        Adds a model as the next replicate, with a random generator seeded from the model
+        where a Map seeds its VectorEngine. Returns its engine and occupancy.
+        """
+        index = len(self.engine.models)
+        self.engine.models.append(model)
+        self.engine.rngs.append(np.random.default_rng(model.random.getrandbits(64)))
+        return ReplicateEngine(self, index), self.occupancy.block(index * self.width, self.width)
+
+    def load_populations(self):
+        """
+        Loads the populations of all replicates into the engine, in blocks by replicate.
+        """
+        names = set.intersection(*(set(population) for population in self.populations))
+        population = {name: np.concatenate([np.asarray(p[name]) for p in self.populations]) for name in names}
+        population["replicate"] = np.repeat(np.arange(len(self.populations)), [len(p["home"]) for p in self.populations])
+        self.engine.load(population)
+        start = 0
+        for model, p in zip(self.models, self.populations):
+            model.engine.rows = slice(start, start + len(p["home"]))
+            start += len(p["home"])
+        self.populations = []
+
+    def step(self):
+        """
+        Runs a single tick of all replicates.
+        """
+        for model in self.models:
+            model.datacollector.collect(model)
+        self.engine.step()
+        for model in self.models:
+            model.schedule.step()
+            model.finished()
+        self.running = self.models[0].running
+
+    def run(self, ticks=RUN_LENGTH):
+        """
+        Runs the replicates for a number of ticks or until the end of the run.
+        """
+        while self.running and self.schedule.steps < ticks:
+            self.step()
+
+    def close(self):
+        """
+        Ends the run of every replicate (see Map.close) and stops the profiler.
+        """
+        for model in self.models:
+            model.close()
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def series(self):
+        """
+        Returns the model series (Victimised, Stopped_Searched and their counts by ethnicity)
+        of all replicates as one DataFrame, with the replicate and Step of every row.
+        """
+        import pandas as pd
+
+        frames = []
+        for r, model in enumerate(self.models):
+            frame = pd.DataFrame(model.datacollector.model_vars)
+            frame.insert(0, "Step", np.arange(len(frame)))
+            frame.insert(0, "replicate", r)
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
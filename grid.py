@@ -0,0 +1,48 @@
+#----------------------------------------------------------------
+class SparseMultiGrid:
+    """
+    A MultiGrid (several agents per cell, no torus) that only stores the cells with agents,
+    in a dictionary of lists, so that a large map costs nothing per empty cell. The agents
+    of a cell are kept in the order they arrived, as in mesa's MultiGrid.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = {}
+
+    def place_agent(self, agent, pos):
+        """
+        Places an agent on a cell.
+        """
+        cell = self.cells.setdefault(pos, [])
+        if agent not in cell:
+            cell.append(agent)
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        """
+        Removes an agent from its cell.
+        """
+        cell = self.cells[agent.pos]
+        cell.remove(agent)
+        if not cell:
+            del self.cells[agent.pos]
+        agent.pos = None
+
+    def move_agent(self, agent, pos):
+        """
+        Moves an agent to a cell.
+        """
+        if not (0 <= pos[0] < self.width and 0 <= pos[1] < self.height):
+            raise Exception("Point out of bounds, and space non-toroidal.")
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+    def get_cell_list_contents(self, pos):
+        """
+        Returns the agents on a cell.
+        """
+        return list(self.cells.get(pos, ()))
+
+    def is_cell_empty(self, pos):
+        return pos not in self.cells
@@ -0,0 +1,63 @@
+#----------------------------------------------------------------
+class HotspotIndex:
+    """
+    Keeps a set of cells ordered by their number of crime incidents, highest first, so that
+    the top hot spots can be read without scanning the map.
+
+    Cells with the same count form a contiguous block in the order. Counts only grow by one,
+    so an increment swaps the cell to the front of its block, which then becomes the back of
+    the block above it. Increments are O(1) and the top k cells are the first k of the order.
+    Cells that are not given join the index at the back with their first incident.
+    """
+    def __init__(self, cells=()):
+        """
+        Creates the index for a list of cell ids (none by default), all starting with zero incidents.
+        """
+        self.order = list(cells)
+        self.rank = {cell: i for i, cell in enumerate(self.order)}
+        self.count = dict.fromkeys(self.order, 0)
+        self.head = {0: 0} if self.order else {} # First position of the block of each count
+
+    def __len__(self):
+        return len(self.order)
+
+    def increment(self, cell):
+        """
+        Adds one crime incident to a cell.
+        """
+        if cell not in self.count:
+            # A new cell is a block of zero incidents at the back, behind all cells with crime.
+            self.rank[cell] = len(self.order)
+            self.order.append(cell)
+            self.count[cell] = 0
+            self.head.setdefault(0, len(self.order) - 1)
+        count = self.count[cell]
+        i = self.rank[cell]
+        h = self.head[count]
+
+        # Swap the cell with the first cell of its block.
+        first = self.order[h]
+        self.order[h], self.order[i] = cell, first
+        self.rank[cell], self.rank[first] = h, i
+
+        # The block of the old count now starts one position later (or is empty).
+        if h + 1 < len(self.order) and self.count[self.order[h + 1]] == count:
+            self.head[count] = h + 1
+        else:
+            del self.head[count]
+
+        # The cell is now the last cell of the block with the new count.
+        self.count[cell] = count + 1
+        if count + 1 not in self.head:
+            self.head[count + 1] = h
+
+    def top(self, k=5):
+        """
+        Returns the (up to) k cells with the most crime incidents, ignoring cells without crime.
+        """
+        hotspots = []
+        for cell in self.order[:k]:
+            if self.count[cell] == 0:
+                break
+            hotspots.append(cell)
+        return hotspots
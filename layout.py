@@ -0,0 +1,96 @@
+import os
+import numpy as np
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Street layout values of the parametric grid:
+ROAD_X_SPACING = 3 # A north-south road on every 3rd column.
+ROAD_Y_SPACING = 6 # An east-west road on every 6th row.
+ZONES = (2, 2) # Zones across (west to east) and down (north to south).
+
+# File names of the arrays of a layout directory. The risk file is optional.
+LAYOUT_FILES = {"road": "road.npy", "zones": "zones.npy", "risk": "risk.npy"}
+
+
+#----------------------------------------------------------------
+class Layout:
+    """
+    The city a model runs on: the road raster, the zone map and the risk of every cell,
+    all [x, y] arrays of the same shape. Zones are numbered 1 to n_zones. Without a risk
+    surface the model draws one.
+
+    The arrays may be memory mapped, so a large city is only read where it is used. Loading a
+    city is cheap, but each new trip of an agent is a path search that grows with the size of
+    the city: about 2.5 ms on a 1000x1000 raster, where 2000 civilians take 5 s for their first
+    tick and 50 ms for every tick after it. Populations at the density of the original 100x103
+    city are only practical on layouts of about that size.
+    """
+    def __init__(self, road, zones, risk=None):
+        road = np.asarray(road)
+        zones = np.asarray(zones)
+        if road.ndim != 2 or zones.shape != road.shape or (risk is not None and np.shape(risk) != road.shape):
+            raise ValueError("The road, zone and risk arrays must have the same [x, y] shape")
+        self.road = road if road.dtype == np.bool_ else road.astype(bool)
+        self.zones = zones
+        self.risk = None if risk is None else np.asarray(risk)
+        self.width, self.height = road.shape
+        zone_ids = np.unique(zones)
+        self.n_zones = len(zone_ids)
+        if zone_ids[0] != 1 or zone_ids[-1] != self.n_zones:
+            raise ValueError("Zones must be numbered 1 to the number of zones")
+
+    def with_risk(self, risk):
+        """
+        Returns the layout with a risk surface (flat or [x, y]).
+        """
+        return Layout(self.road, self.zones, np.asarray(risk).reshape(self.width, self.height))
+
+
+def zone_map(width, height, zones=ZONES):
+    """
+    Returns the [x, y] zone map of zones = (across, down) equal rectangles, numbered row by row
+    from the north west. With (2, 2) on 100 x 103 cells zone 1 is x < 50 and y > 51.
+    """
+    across, down = zones
+    x_cuts = np.floor(width * np.arange(1, across) / across + 0.5)
+    y_cuts = np.floor(height * np.arange(1, down) / down + 0.5)
+    column = np.searchsorted(x_cuts, np.arange(width), side="right")
+    row = down - 1 - np.searchsorted(y_cuts, np.arange(height), side="right") # Row 0 is the north.
+    return row[None, :] * across + column[:, None] + 1
+
+
+def grid_layout(width, height, x_spacing=ROAD_X_SPACING, y_spacing=ROAD_Y_SPACING, zones=ZONES, risk=None):
+    """
+    Returns a city of width x height cells with a road on every x_spacing-th column and every
+    y_spacing-th row, and zones = (across, down) rectangular zones.
+    """
+    x_cor = np.arange(width)[:, None]
+    y_cor = np.arange(height)[None, :]
+    road = (x_cor % x_spacing == 0) | (y_cor % y_spacing == 0)
+    return Layout(road, zone_map(width, height, zones), risk)
+
+
+def load_layout(directory, mmap_mode="r"):
+    """
+    Loads the road raster, zone map and (if present) risk surface from the .npy files of
+    LAYOUT_FILES in a directory, memory mapped with mmap_mode ("r" by default, None to read them).
+    """
+    arrays = {}
+    for name, file_name in LAYOUT_FILES.items():
+        path = os.path.join(directory, file_name)
+        if name == "risk" and not os.path.exists(path):
+            arrays[name] = None
+        else:
+            arrays[name] = np.load(path, mmap_mode=mmap_mode)
+    return Layout(arrays["road"], arrays["zones"], arrays["risk"])
+
+
+def save_layout(layout, directory):
+    """
+    Writes a layout to the .npy files of LAYOUT_FILES in a directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, LAYOUT_FILES["road"]), layout.road)
+    np.save(os.path.join(directory, LAYOUT_FILES["zones"]), layout.zones)
+    if layout.risk is not None:
+        np.save(os.path.join(directory, LAYOUT_FILES["risk"]), layout.risk)
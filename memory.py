@@ -0,0 +1,106 @@
+import gc
+import sys
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Population the per agent sizes are projected to.
+TARGET_CIVILIANS = 1000000
+
+# Objects shared by all agents (constants), which are not counted in the size of an agent.
+SHARED_TYPES = (str, bool, type(None))
+
+
+def attribute_values(obj):
+    """
+    Returns the values of the slots of an object and its __dict__, if it has been created
+    (reading obj.__dict__ would create it).
+    """
+    return [value for value in gc.get_referents(obj) if not isinstance(value, type)]
+
+
+def deep_size(obj, shared):
+    """
+    Returns the bytes of obj and of the objects it holds, except the shared ones
+    (ids in shared, constants and small ints).
+    """
+    if id(obj) in shared or isinstance(obj, SHARED_TYPES):
+        return 0
+    if isinstance(obj, int) and -5 <= obj <= 256:
+        return 0 # Small ints are cached by Python.
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list, set)):
+        size += sum(deep_size(item, shared) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(deep_size(k, shared) + deep_size(v, shared) for k, v in obj.items())
+    elif hasattr(type(obj), "__slots__"):
+        size += sum(deep_size(value, shared) for value in attribute_values(obj))
+    return size
+
+
+def agent_bytes(agents, shared):
+    """
+    Returns the mean bytes of a list of agents.
+    """
+    if len(agents) == 0:
+        return 0.0
+    return sum(deep_size(agent, shared) for agent in agents) / len(agents)
+
+
+def memory_report(model):
+    """
+    Returns one row per part of the model that grows with the number of agents: the part,
+    its count, the bytes of each, the total and, for the parts that grow per civilian, the
+    projection to TARGET_CIVILIANS civilians. Routes grow with the number of destinations,
+    which is at most the number of cells.
+    """
+    shared = {id(model)} | {id(cell) for cell in model.streets.cells}
+    rows = []
+
+    def add(part, count, bytes_each, per_civilian):
+        rows.append({
+            "part": part,
+            "count": count,
+            "bytes_each": float(bytes_each),
+            "total_mb": float(bytes_each * count / 2**20),
+            "projected_mb": float(bytes_each * TARGET_CIVILIANS / 2**20) if per_civilian else None,
+        })
+
+    engine = model.engine
+    if engine is None:
+        civilians = model.civilians
+        add("civilian", len(civilians), agent_bytes(civilians, shared), True)
+        # The entries of the scheduler (active and parked agents) per civilian.
+        schedule = model.schedule
+        entries = (sys.getsizeof(schedule._agents) + sys.getsizeof(schedule.parked)
+            + sum(sys.getsizeof(entry) for entry in schedule.parked.values())
+            + sys.getsizeof(schedule.wakeups) + sum(sys.getsizeof(entry) for entry in schedule.wakeups))
+        add("schedule entry", len(civilians), entries / max(len(civilians), 1), True)
+        # The occupied cells of the grid: a dictionary entry and a list of agents each.
+        cells = model.grid.cells
+        grid_bytes = sys.getsizeof(cells) + sum(sys.getsizeof(cell) for cell in cells.values())
+        add("grid cell", len(cells), grid_bytes / max(len(cells), 1), False)
+    elif not engine.remote:
+        from engine import ROW_ARRAYS
+        arrays = sum(getattr(engine, name).nbytes for name in ROW_ARRAYS)
+        add("civilian (arrays)", engine.n, arrays / max(engine.n, 1), True)
+
+    add("cop", len(model.cops), agent_bytes(model.cops, shared), False)
+    # The cells on the paths found by the router: a dictionary entry and a tuple each.
+    trees = list(model.router.cache.values())
+    steps = sum(len(tree.steps) for tree in trees)
+    tree_bytes = sum(sys.getsizeof(tree.steps) + sum(sys.getsizeof(step) for step in tree.steps.values() if step) for tree in trees)
+    add("path cell", steps, tree_bytes / max(steps, 1), False)
+    return rows
+
+
+def format_memory_report(rows):
+    """
+    Returns the memory report as a text table.
+    """
+    lines = ["{:<20} {:>10} {:>12} {:>10} {:>14}".format(
+        "part", "count", "bytes each", "total MB", "MB at {:.0e}".format(TARGET_CIVILIANS))]
+    for row in rows:
+        projected = "-" if row["projected_mb"] is None else "{:.1f}".format(row["projected_mb"])
+        lines.append("{:<20} {:>10} {:>12.1f} {:>10.1f} {:>14}".format(
+            row["part"], row["count"], row["bytes_each"], row["total_mb"], projected))
+    return "\n".join(lines)
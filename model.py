@@ -1,24 +1,37 @@
 from cProfile import label
 from random import random
+from functools import partial
 import numpy as np
-import scipy.stats as sct
 from mesa import Model
-from mesa.time import RandomActivation
-from mesa.space import MultiGrid
-from mesa.datacollection import DataCollector
-from agent import Civilian, StreetPatch, Cop
+from grid import SparseMultiGrid
+from agent import Civilian, Cop, COP_VISION
+from coverage import CopCoverage
+from occupancy import Occupancy
+from street import StreetLayer
+from layout import grid_layout, load_layout
+from routing import Router
+from scheduler import WakeupActivation
+from engine import VectorEngine
+from distributed import DistributedEngine
+from population import synthesise_population, truncated_poisson, ETHNICITIES
+from collector import StreamingDataCollector
+from counters import GroupedCounter
+from checkpoint import save_checkpoint
+from profiling import PhaseProfiler
 
 # GLOBAL PROCEDURES:
 #--------------------------------------------------------------------------
 def get_total_offences(model):
     """Returns the number of agents that have been a victim to street robbery."""
-    agents = [a.N_victimised for a in model.schedule.agents if isinstance(a, Civilian)]
-    return int(np.sum(agents))
+    return model.victimisations.total
 
 def get_N_stopsearch(model):
     """Returns the number of agents that have been stopped and search"""
-    agents = [a.stop_searched for a in model.schedule.agents if isinstance(a, Civilian)]
-    return int(np.sum(agents))
+    return model.stop_searches.total
+
+def get_count_by_ethnicity(counter, ethnicity, model):
+    """Returns the number of incidents of a counter ("victimisations" or "stop_searches") for one ethnicity."""
+    return getattr(model, counter).by_ethnicity[ethnicity]
 
 def get_ethnicity(agent):
     """Returns the ethnicity of the agent"""
@@ -31,243 +44,151 @@ def get_ethnicity(agent):
 
 # GLOBAL VARIABLES:
 #--------------------------------------------------------------------------
-# Offending variables:
-CRIMINAL_PROPENSITY_RATE = 0.0925 # Rate of agents who have a criminal propensity rate greater than 0.
-CHRONIC_OFFENDER_RATE = 0.05 # Of those with criminal propensity, 5% have a chronic score (propensity = 10).
-
-# Ethnicity values:
-WHITE_PERC = 0.449
-OTHER_PERC = 0.233
-ASIAN_PERC = 0.185
-BLACK_PERC = 0.133
-
 # Time values:
 MONTH = 43200
 YEAR = 518400
 
 RUN_LENGTH = MONTH
 
+
 class Map(Model):
     """
     A model that simulates hot spots policing in a city and contains all the agents.
     """
-    def __init__(self, N, NC, width, height, N_strategic_cops, ethnic_distribution):
+    def __init__(self, N, NC, width, height, N_strategic_cops, ethnic_distribution, zonal_hotspots=False, vectorised=False,
+    collect_period=None, collect_changes=False, collect_path=None, seed=None, checkpoint_every=None, checkpoint_path=None,
+    profile=False, crime_half_life=None, distributed=False, tiles=None, layout=None, ensemble=None):
+        # seed is taken by Model.__new__ to seed self.random, from which the other generators are seeded.
+        # layout is a Layout or the directory of its files; without one the city is a grid_layout.
+        # width and height are then those of the layout. Routing grows with the size of the city, see Layout.
+        # A model made by an Ensemble (see ensemble.py) is one of its replicates and shares its city.
+        if checkpoint_every and not checkpoint_path:
+            raise ValueError("checkpoint_every needs a checkpoint_path")
+        if ensemble is not None:
+            layout = ensemble.layout
+        if isinstance(layout, str):
+            layout = load_layout(layout)
+        if layout is None:
+            layout = grid_layout(width, height)
+        width, height = layout.width, layout.height
+        self.random = self.random # Model.__new__ sets the generator on the class; keep it on the model so it is saved in checkpoints.
         self.num_agents = N
         self.num_cops = NC
-        self.grid = MultiGrid(width, height, torus=False)
-        self.schedule = RandomActivation(self)
+        self.grid = SparseMultiGrid(width, height)
+        self.schedule = WakeupActivation(self)
         self.running =  True
         self.N_victims = 0
         self.N_ticks = 0
         # Changeable parameters:
         self.N_strategic_cops = N_strategic_cops # Slider: Adjust the percentage of strategic cops.
         self.ethnic_distribution = ethnic_distribution
+        self.zonal_hotspots = zonal_hotspots # Hot spot cops only target hot spots in their patrol area.
+        self.checkpoint_every = checkpoint_every # Write a checkpoint every checkpoint_every ticks.
+        self.checkpoint_path = checkpoint_path
+        # Time the phases of every tick (see profiling.PhaseProfiler).
+        self.profiler = PhaseProfiler() if profile else None
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.rng = np.random.default_rng(self.random.getrandbits(64)) # Batched draws are made with NumPy.
+        # Running counts of victimisations and stop and searches.
+        self.victimisations = GroupedCounter()
+        self.stop_searches = GroupedCounter()
 
-        # Initialise streetpatch agents.
+        # Initialise the street layer.
         #----------------------------------------------------------------
-        for x_k in range(width):
-            for y_k in range(height):
-                """creates an agent with unique ID"""
-                i = 30000 + (x_k * height) + y_k
-                position = (x_k, y_k)
-                risk = self.truncated_poisson(0.19, 6, 1) # Draw a random number from a poisson distribution.
-                crime_incidents = 0
+        if layout.risk is None:
+            layout = layout.with_risk(self.truncated_poisson(0.19, 6, width * height)) # Draw random numbers from a poisson distribution.
+        self.layout = layout
+        self.cop_coverage = CopCoverage(width, height, COP_VISION)
+        if ensemble is not None:
+            # The streets are the ensemble's, with crime counts of this replicate.
+            self.streets = ensemble.streets.replicate()
+        else:
+            self.streets = StreetLayer(layout, crime_half_life=crime_half_life) # Hot spots decay with crime_half_life (ticks) if given.
+            self.occupancy = Occupancy(width, height) # Civilians per cell, to find encounters.
+        self.router = Router(self.streets) # Paths are found as they are walked, so they depend on the walks of this model only.
 
-                # Create grid number for each section of the map
-                if y_k > 51 and x_k < 50:
-                    grid_nr = 1
-                elif y_k > 51 and x_k >= 50:
-                    grid_nr = 2
-                elif y_k <= 51 and x_k < 50:
-                    grid_nr = 3
-                elif y_k <= 51 and x_k >= 50:
-                    grid_nr = 4
+        # The vectorised engine keeps the civilians in arrays instead of the scheduler and grid.
+        # The distributed engine runs them in one process per zone (or per tile of a tiles = (nx, ny) grid).
+        # The civilians of a replicate are in the engine of its ensemble.
+        if ensemble is not None:
+            self.engine, self.occupancy = ensemble.add_replicate(self)
+        elif distributed:
+            self.engine = DistributedEngine(self, width, height, tiles)
+        elif vectorised:
+            self.engine = VectorEngine(self, width, height)
+        else:
+            self.engine = None
 
-                s = StreetPatch(i, self, position, risk, crime_incidents, grid_nr)
-                """adds the agent to the scheduler"""
-                self.schedule.add(s)
-                """adds the agent to a grid cell"""
-                self.grid.place_agent(s, position)     
-        
         # Initialise civilian agents.
         #----------------------------------------------------------------
-        criminal_propensity_rate = CRIMINAL_PROPENSITY_RATE
-        chronic_offender_rate = CHRONIC_OFFENDER_RATE
-        
-        # Offender values
-        criminal_total = round(self.num_agents * criminal_propensity_rate) # Number of agents with criminal propensity greater than 0.
-        chronic_criminal = round(criminal_total * chronic_offender_rate) # Number of chronic offenders.
-        criminal_non_chronic = round(self.num_agents * criminal_propensity_rate - chronic_criminal) # Number of non-chronic agents with greater criminal propensity than 0.
-
-        white_pop = self.num_agents * WHITE_PERC
-        other_pop = self.num_agents * OTHER_PERC
-        asian_pop = self.num_agents * ASIAN_PERC
-        black_pop = self.num_agents * BLACK_PERC
-
-        # Set up zone values:
-        zone_1 = (self.num_agents/4)-(criminal_total/4)
-        zone_2 = (self.num_agents/4)-(criminal_total/4)
-        zone_3 = (self.num_agents/4)-(criminal_total/4)
-
-        for i_k in range(self.num_agents):
-            moving = "moving"
-            destination = []
-            timer = 0
-            travel_speed = np.random.uniform(6,9)
-            N_victimised = 0
-            stop_searched = 0
-            attractiveness = self.random_distribution()
-            perceived_guardianship = self.random_distribution()
-            perceived_capability = np.random.uniform(-5,6) # random number between -5 and 5.
+        # Draw the attributes of the whole population at once.
+        population = synthesise_population(self.rng, self.num_agents, ethnic_distribution, self.streets)
 
-            # Assign criminal propensity rates to all agents. 
-            if criminal_non_chronic > 0:
-                criminal_propensity = self.random.choice(range(6,10,1)) # Propensity score between 6 and 9
-                criminal_non_chronic -= 1
-                chronic_offender = False
-                time_to_offending = np.random.uniform(0,43200)
-                victimisation = 0 # Will not be used
-                zone = self.random.choice(range(1,5)) # Give the offender a random grid cell
-            elif chronic_criminal > 0:
-                criminal_propensity = 10 # Propensity score of 10
-                chronic_criminal -= 1
-                chronic_offender = True
-                time_to_offending = 0
-                victimisation = 0 # Will not be used
-                zone = self.random.choice(range(1,5)) # Give the offender a random grid cell
-            else:
-                criminal_propensity = 0 # Propensity score of 0
-                chronic_offender = False
-                time_to_offending = 0 # Not applicable to law-abiding citizens.
-                victimisation = 20
-                # Assign zones to civilians with no criminal propensity:
-                if zone_1 > 0:
-                    zone = 1
-                    zone_1 -= 1
-                elif zone_2 > 0:
-                    zone = 2
-                    zone_2 -= 1
-                elif zone_3 > 0:
-                    zone = 3
-                    zone_3 -= 1
-                else:
-                    zone = 4
-
-            list_of_nodes = self.random_activity_generator(zone) 
-            list_of_risky_nodes = self.risky_activity_generator(zone)
-            position = list_of_nodes[0]
-            prev_position = list_of_nodes[0]
-
-            # Assign random activity nodes for the agents. This will be their routine activities.
-            activity_nodes = []
-            activity_nodes.append(list_of_nodes[1])
-            activity_nodes.append(list_of_nodes[2])
-            activity_nodes.append(list_of_risky_nodes[0])
-            activity_nodes.append(list_of_risky_nodes[1])
-            
-            # Assignment of ethnicities in the model:
-            if ethnic_distribution == 1:
-                # Assign ethnicities to the population - Ethnic diversity in zone 1 and only whites in the other zones.
-                if white_pop > 0:
-                    white_pop -= 1
-                    ethnicity = "white"
-                elif other_pop > 0:
-                    other_pop -= 1
-                    ethnicity = "other"
-                elif asian_pop > 0:
-                    asian_pop -= 1
-                    ethnicity = "asian"
-                elif black_pop > 0:
-                    black_pop -= 1
-                    ethnicity = "black"    
-            
-            elif ethnic_distribution == 2:
-                # Assign ethnicities to the population - Uniform distribution
-                list_of_possible_ethn = []
-                pops = [white_pop, other_pop, asian_pop, black_pop]
-                for i in pops:
-                    if i > 0:
-                        if i == white_pop:
-                            list_of_possible_ethn.append("white")
-                        elif i == other_pop:
-                            list_of_possible_ethn.append("other")     
-                        elif asian_pop > 0:
-                            list_of_possible_ethn.append("asian")
-                        elif black_pop > 0:
-                            list_of_possible_ethn.append("black")
-            
-                random_float = self.random.uniform(0, 100)
-                if random_float < 44.9 and "white" in list_of_possible_ethn:
-                    ethnicity = "white"
-                    white_pop -= 1
-                elif 44.9 < random_float < 68.2 and "other" in list_of_possible_ethn:
-                    ethnicity = "other"
-                    other_pop -= 1
-                elif 68.2 < random_float < 86.7 and "asian" in list_of_possible_ethn:
-                    ethnicity = "asian"
-                    asian_pop -= 1
-                else:
-                    ethnicity = "black"
-                    black_pop -= 1
-
-            a = Civilian(i_k, 
-            self, 
-            position, 
-            prev_position, 
-            activity_nodes, 
-            moving, 
-            destination, 
-            timer, 
-            criminal_propensity,
-            chronic_offender,
-            travel_speed,
-            time_to_offending,
-            victimisation,
-            attractiveness,
-            perceived_guardianship,
-            perceived_capability,
-            N_victimised,
-            ethnicity,
-            zone,
-            stop_searched)
-            self.schedule.add(a)
-            self.grid.place_agent(a, position)
+        self.civilians = []
+        if self.engine is not None:
+            self.engine.load(population)
+        else:
+            for i_k in range(self.num_agents):
+                position = self.streets.cell(population["home"][i_k])
+                activity_nodes = tuple(self.streets.cell(node) for node in population["nodes"][i_k])
+                a = Civilian(int(population["unique_id"][i_k]), 
+                self, 
+                position, 
+                position, 
+                activity_nodes, 
+                "moving", 
+                [], 
+                0, 
+                int(population["criminal_propensity"][i_k]),
+                bool(population["chronic_offender"][i_k]),
+                float(population["travel_speed"][i_k]),
+                float(population["time_to_offending"][i_k]),
+                int(population["victimisation"][i_k]),
+                float(population["attractiveness"][i_k]),
+                float(population["perceived_guardianship"][i_k]),
+                float(population["perceived_capability"][i_k]),
+                0,
+                ETHNICITIES[population["ethnicity"][i_k]],
+                int(population["zone"][i_k]),
+                0)
+                self.schedule.add(a)
+                self.grid.place_agent(a, position)
+                self.occupancy.add(position)
+                self.civilians.append(a)
 
         # Initialise cop agents.
         #----------------------------------------------------------------
         # Cop values:
         nr_of_officers = round(self.num_cops * (self.N_strategic_cops / 100)) # Only strategic
-        patrol_1 = (self.num_cops/4) - (nr_of_officers/4)
-        patrol_2 = (self.num_cops/4) - (nr_of_officers/4)
-        patrol_3 = (self.num_cops/4) - (nr_of_officers/4)
+        n_zones = self.streets.n_zones
+        zones = list(range(1, n_zones + 1))
+        # Patrols left to fill in each zone but the last, which takes the remaining cops.
+        patrols = [(self.num_cops/n_zones) - (nr_of_officers/n_zones) for _ in range(n_zones - 1)]
 
+        self.cops = []
         for j_k in range(self.num_cops):
             cop_id = j_k + 20000
-            prev_position = position
             moving = "moving" 
             timer = 0
-            travel_speed = np.random.uniform(6,9)
+            travel_speed = self.rng.uniform(6,9)
 
             if nr_of_officers > 0:
                 nr_of_officers -= 1
                 hotspot_patrol = True
-                patrol_area = self.random.choice([1,2,3,4]) 
+                patrol_area = self.random.choice(zones) 
             else:
                 hotspot_patrol = False    
                 # Create patrol areas for the cop agents
-                if patrol_1 > 0:
-                    patrol_area = 1
-                    patrol_1 -= 1
-                elif patrol_2 > 0:
-                    patrol_area = 2
-                    patrol_2 -= 1
-                elif patrol_3 > 0:
-                    patrol_3 -= 1
-                    patrol_area = 3
-                else:
-                    patrol_area = 4
+                patrol_area = n_zones
+                for zone, left in enumerate(patrols, start=1):
+                    if left > 0:
+                        patrol_area = zone
+                        patrols[zone - 1] -= 1
+                        break
             
             position = self.random_patrol_node_generator(patrol_area)
+            prev_position = position
             
 
             # Assign random 1 random activity node. This will change everytime the cop arrives at the node.
@@ -286,77 +207,38 @@ class Map(Model):
             patrol_area)
             self.schedule.add(b)
             self.grid.place_agent(b, position)
+            self.cop_coverage.add(position)
+            self.cops.append(b)
 
         # Metric to measure the model.
         #----------------------------------------------------------------
-        self.datacollector = DataCollector(
+        self.datacollector = StreamingDataCollector(
             model_reporters={
                 "Victimised": get_total_offences,
                 "Stopped_Searched": get_N_stopsearch,
+                **{"Victimised_" + e: partial(get_count_by_ethnicity, "victimisations", e) for e in ETHNICITIES},
+                **{"Stopped_Searched_" + e: partial(get_count_by_ethnicity, "stop_searches", e) for e in ETHNICITIES},
                 },
-            agent_reporters={
-                "Ethnicity": lambda a: getattr(a, "ethnicity", None),
-                "zone": lambda a: getattr(a, "zone", None),
-                "N_victimised": lambda a: getattr(a, "N_victimised", None),
-                "N_stop_searched": lambda a: getattr(a, "stop_searched", None)
-            }
+            period=collect_period, # Record civilian level data every collect_period ticks (None: never).
+            on_change=collect_changes, # Only record civilians whose counts changed.
+            path=collect_path # Stream civilian level data to this directory instead of memory.
         )
 
-    def random_distribution(self):
-        lower = 1
-        upper = 11
-        mu = 5.5
-        sigma = 1.2
-        N = 1
-
-        random_distr = sct.truncnorm.rvs(
-            (lower-mu)/sigma,(upper-mu)/sigma,loc=mu,scale=sigma,size=N)
-        
-        return random_distr
-
-    def random_activity_generator(self, zone):
+    def set_strategic_cops(self, N_strategic_cops):
         """
-        Creates a random node for the agent which will serve as the civilians' home and activity nodes.
+        Changes the percentage of strategic cops during a run. As in the set up the first cops
+        are the hot spot patrols; all cops keep their patrol areas.
         """
-        list_of_roads = []
-        list_of_output = []
-        for i in self.schedule.agents:
-            if i.typ == "building" and i.grid_nr == zone:
-                list_of_roads.append(i.pos)
-        
-        for _ in range(3):
-            selection = self.random.choice(list_of_roads)
-            list_of_output.append(selection)
+        self.N_strategic_cops = N_strategic_cops
+        nr_of_officers = round(self.num_cops * (N_strategic_cops / 100))
+        for i, cop in enumerate(self.cops):
+            cop.hotspot_patrol = i < nr_of_officers
 
-        return list_of_output 
-    
-    def risky_activity_generator(self, zone):
-        """
-        Selects random nodes that are risky (risk > 0)
-        """
-        list_of_risky_roads = []
-        list_of_output = []
-        for i in self.schedule.agents:
-            if i.typ == "building" and i.grid_nr == zone and i.risk > 0:
-                list_of_risky_roads.append(i.pos)
-        for _ in range(2):
-            selection = self.random.choice(list_of_risky_roads)
-            list_of_output.append(selection)
-        
-        return(list_of_output)
-    
     def random_patrol_node_generator(self, patrol_area):
         """
         Create a random node on the road map where the cop agent will move to.
         """
-        grid_zone = patrol_area
-        roads = [obj for obj in self.schedule.agents if isinstance(obj, StreetPatch)]
-        list_of_roads = []
-        for i in roads:
-            if i.typ == "road" and i.grid_nr == grid_zone:
-                list_of_roads.append(i.pos)
-        
-        xy = self.random.choice(list_of_roads)
+        xy = self.streets.random_node(self.random, patrol_area, "road")
 
         return (xy)
 
@@ -365,8 +247,36 @@ class Map(Model):
         Runs a single tick of the clock in the simulation.
         """
         self.datacollector.collect(self)
+        if self.engine is not None:
+            self.engine.step()
         self.schedule.step()
+        if self.engine is not None and self.engine.remote:
+            self.engine.stopsearch() # The stop and searches the cops asked for.
         self.finished()
+        if self.checkpoint_every and self.schedule.steps % self.checkpoint_every == 0:
+            save_checkpoint(self, self.checkpoint_path)
+
+    def civilian_table(self):
+        """
+        Returns the civilian level data as arrays: unique_id, ethnicity, zone, N_victimised and stop_searched.
+        """
+        if self.engine is not None:
+            return self.engine.civilian_table()
+        return {
+            "unique_id": np.array([a.unique_id for a in self.civilians], dtype=np.int64),
+            "ethnicity": np.array([a.ethnicity for a in self.civilians]),
+            "zone": np.array([a.zone for a in self.civilians], dtype=np.int64),
+            "N_victimised": np.array([a.N_victimised for a in self.civilians], dtype=np.int64),
+            "stop_searched": np.array([a.stop_searched for a in self.civilians], dtype=np.int64),
+        }
+
+    def civilians_at(self, pos):
+        """
+        Returns the civilians on a cell.
+        """
+        if self.engine is not None:
+            return self.engine.civilians_at(pos)
+        return [agent for agent in self.grid.get_cell_list_contents(pos) if agent.typ == "civilian"]
     
     def finished(self):
         """
@@ -374,17 +284,26 @@ class Map(Model):
         """
         if self.N_ticks == RUN_LENGTH:
             self.running = False
+            self.close()
         else:
             self.N_ticks += 1
 
+    def close(self):
+        """
+        Ends the run, also when it is stopped before RUN_LENGTH: writes the collected data,
+        stops the workers of a distributed engine and the profiler. Only the first call does this.
+        """
+        if getattr(self, "closed", False):
+            return
+        self.closed = True
+        self.datacollector.close()
+        if self.engine is not None and self.engine.remote:
+            self.engine.close()
+        if self.profiler is not None:
+            self.profiler.disable()
+
     def truncated_poisson(self, mu, max_value, size):
         """
-        Returns a random number based on a poisson distribution.
+        Returns size random numbers from a poisson distribution truncated at max_value.
         """
-        temp_size = size
-        while True:
-            temp_size *= 2
-            temp = sct.poisson.rvs(mu, size=temp_size)
-            truncated = temp[temp <= max_value]
-            if len(truncated) >= size:
-                return truncated[:size]
+        return truncated_poisson(self.rng, mu, max_value, size)
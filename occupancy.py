@@ -0,0 +1,82 @@
+import numpy as np
+
+
+#----------------------------------------------------------------
+class Occupancy:
+    """
+    Keeps the number of civilians on each cell up to date as they move, so that encounters
+    (cells with two or more civilians) are found without looking at the cell contents.
+
+    civilian_count is indexed by [x, y]; flat is a view of it indexed by flat cell index.
+    Only civilian_count is stored, so the two stay one array when the model is pickled.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.civilian_count = np.zeros((width, height), dtype=np.int32)
+
+    @property
+    def flat(self):
+        return self.civilian_count.reshape(-1)
+
+    def block(self, x0, width):
+        """
+        Returns an Occupancy of the columns x0 to x0 + width, sharing the counts of this one.
+        """
+        return OccupancyBlock(self, x0, width)
+
+    def add(self, pos):
+        """
+        Registers a civilian at pos.
+        """
+        self.civilian_count[pos] += 1
+
+    def move(self, old_pos, new_pos):
+        """
+        Moves a civilian from old_pos to new_pos.
+        """
+        self.civilian_count[old_pos] -= 1
+        self.civilian_count[new_pos] += 1
+
+    def count(self, pos):
+        """
+        Returns the number of civilians on a cell.
+        """
+        return self.civilian_count[pos]
+
+    def load(self, cells):
+        """
+        Sets the counts from the flat cell indices of all civilians.
+        """
+        self.flat[:] = np.bincount(cells, minlength=self.flat.size)
+
+    def move_many(self, old_cells, new_cells):
+        """
+        Moves many civilians at once (flat cell indices); only those that changed cell are counted.
+        """
+        moved = old_cells != new_cells
+        np.subtract.at(self.flat, old_cells[moved], 1)
+        np.add.at(self.flat, new_cells[moved], 1)
+
+    def crowded(self, cells, min_count=2):
+        """
+        Returns a mask of the flat cell indices with at least min_count civilians.
+        """
+        return self.flat[cells] >= min_count
+
+
+#----------------------------------------------------------------
+class OccupancyBlock(Occupancy):
+    """
+    The columns x0 to x0 + width of another Occupancy. The counts are read from that
+    occupancy on every access, so the block shares them also after pickling.
+    """
+    def __init__(self, occupancy, x0, width):
+        self.occupancy = occupancy
+        self.x0 = x0
+        self.width = width
+        self.height = occupancy.height
+
+    @property
+    def civilian_count(self):
+        return self.occupancy.civilian_count[self.x0:self.x0 + self.width]
@@ -0,0 +1,159 @@
+import numpy as np
+import scipy.stats as sct
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Offending variables:
+CRIMINAL_PROPENSITY_RATE = 0.0925 # Rate of agents who have a criminal propensity rate greater than 0.
+CHRONIC_OFFENDER_RATE = 0.05 # Of those with criminal propensity, 5% have a chronic score (propensity = 10).
+
+# Ethnicity values:
+WHITE_PERC = 0.449
+OTHER_PERC = 0.233
+ASIAN_PERC = 0.185
+BLACK_PERC = 0.133
+
+# Ethnicities in the order of their codes.
+ETHNICITIES = ("white", "other", "asian", "black")
+ETHNIC_PERC = (WHITE_PERC, OTHER_PERC, ASIAN_PERC, BLACK_PERC)
+
+# Upper bounds (percent) of the uniform draw for each ethnicity in the uniform distribution.
+ETHNIC_CUTS = (44.9, 68.2, 86.7)
+
+# Truncated normal distribution of attractiveness and perceived guardianship.
+TRUNCNORM_LOWER = 1
+TRUNCNORM_UPPER = 11
+TRUNCNORM_MU = 5.5
+TRUNCNORM_SIGMA = 1.2
+
+
+def truncated_poisson(rng, mu, max_value, size):
+    """
+    Returns size random numbers from a poisson distribution truncated at max_value.
+    """
+    temp_size = size
+    while True:
+        temp_size *= 2
+        temp = sct.poisson.rvs(mu, size=temp_size, random_state=rng)
+        truncated = temp[temp <= max_value]
+        if len(truncated) >= size:
+            return truncated[:size]
+
+
+def truncated_normal(rng, size):
+    """
+    Draws values from the truncated normal distribution of attractiveness and guardianship.
+    """
+    return sct.truncnorm.rvs(
+        (TRUNCNORM_LOWER - TRUNCNORM_MU) / TRUNCNORM_SIGMA,
+        (TRUNCNORM_UPPER - TRUNCNORM_MU) / TRUNCNORM_SIGMA,
+        loc=TRUNCNORM_MU,
+        scale=TRUNCNORM_SIGMA,
+        size=size,
+        random_state=rng)
+
+
+def assign_zones(rng, N, criminal_total, n_offenders, n_zones=4):
+    """
+    Offenders get a random zone; the other civilians fill zones 1 to n_zones - 1 up to their
+    quota (N/n_zones - criminal_total/n_zones each) in turn and the rest go to the last zone.
+    """
+    zone = np.empty(N, dtype=np.int16)
+    zone[:n_offenders] = rng.integers(1, n_zones + 1, n_offenders)
+    quota = int(np.ceil(max(N / n_zones - criminal_total / n_zones, 0)))
+    start = n_offenders
+    for z in range(1, n_zones):
+        end = min(start + quota, N)
+        zone[start:end] = z
+        start = end
+    zone[start:] = n_zones
+    return zone
+
+
+def assign_ethnicities(rng, N, ethnic_distribution):
+    """
+    Returns the ethnicity codes (index in ETHNICITIES) of the population.
+
+    1 = Homogenous distribution: the population is filled in order with each ethnicity's quota.
+    2 = Uniform distribution: each civilian draws an ethnicity, and once an ethnicity other
+        than black has used its quota any further draws of it become black.
+    """
+    quotas = np.ceil(N * np.array(ETHNIC_PERC)).astype(np.int64)
+    if ethnic_distribution == 1:
+        return np.repeat(np.arange(len(ETHNICITIES), dtype=np.uint8), quotas)[:N]
+
+    draw = rng.uniform(0, 100, N)
+    ethnicity = np.full(N, ETHNICITIES.index("black"), dtype=np.uint8)
+    bounds = (0,) + ETHNIC_CUTS
+    for code in range(len(ETHNIC_CUTS)):
+        if code == 0:
+            drawn = draw < bounds[1]
+        else:
+            drawn = (bounds[code] < draw) & (draw < bounds[code + 1])
+        # The k-th draw of an ethnicity is only accepted while k is within its quota.
+        accepted = drawn & (np.cumsum(drawn) <= quotas[code])
+        ethnicity[accepted] = code
+    return ethnicity
+
+
+def sample_nodes(rng, streets, zone, kind, count):
+    """
+    Draws count random nodes of a kind for every civilian from the node pool of its zone.
+    Returns an (N, count) array of flat cell indices.
+    """
+    nodes = np.empty((len(zone), count), dtype=np.int64)
+    for z in np.unique(zone):
+        members = np.flatnonzero(zone == z)
+        pool = streets.node_pools[(int(z), kind)]
+        if len(pool) == 0:
+            raise IndexError("Cannot choose from an empty sequence")
+        picks = pool[rng.integers(0, len(pool), (len(members), count))]
+        nodes[members] = picks[..., 0] * streets.height + picks[..., 1]
+    return nodes
+
+
+def synthesise_population(rng, N, ethnic_distribution, streets):
+    """
+    Draws the attributes of the whole civilian population with batched random draws.
+
+    Returns a dictionary of arrays with one element per civilian. The population is ordered as
+    in the original set up: non-chronic offenders first, then chronic offenders, then
+    law-abiding civilians. Positions (home and the four activity nodes) are flat cell indices.
+    """
+    # Offender values
+    criminal_total = round(N * CRIMINAL_PROPENSITY_RATE) # Number of agents with criminal propensity greater than 0.
+    chronic_criminal = round(criminal_total * CHRONIC_OFFENDER_RATE) # Number of chronic offenders.
+    criminal_non_chronic = round(N * CRIMINAL_PROPENSITY_RATE - chronic_criminal) # Number of non-chronic agents with greater criminal propensity than 0.
+    criminal_non_chronic = min(criminal_non_chronic, N)
+    chronic_criminal = min(chronic_criminal, N - criminal_non_chronic)
+    n_offenders = criminal_non_chronic + chronic_criminal
+
+    criminal_propensity = np.zeros(N, dtype=np.int16)
+    criminal_propensity[:criminal_non_chronic] = rng.integers(6, 10, criminal_non_chronic) # Propensity score between 6 and 9
+    criminal_propensity[criminal_non_chronic:n_offenders] = 10 # Propensity score of 10
+    chronic_offender = np.zeros(N, dtype=bool)
+    chronic_offender[criminal_non_chronic:n_offenders] = True
+    time_to_offending = np.zeros(N)
+    time_to_offending[:criminal_non_chronic] = rng.uniform(0, 43200, criminal_non_chronic)
+    victimisation = np.full(N, 20, dtype=np.int16)
+    victimisation[:n_offenders] = 0 # Will not be used
+
+    zone = assign_zones(rng, N, criminal_total, n_offenders, streets.n_zones)
+    buildings = sample_nodes(rng, streets, zone, "building", 3)
+    risky = sample_nodes(rng, streets, zone, "risky", 2)
+
+    return {
+        "unique_id": np.arange(N, dtype=np.int64),
+        "home": buildings[:, 0],
+        "nodes": np.concatenate([buildings[:, 1:], risky], axis=1),
+        "travel_speed": rng.uniform(6, 9, N),
+        "criminal_propensity": criminal_propensity,
+        "chronic_offender": chronic_offender,
+        "time_to_offending": time_to_offending,
+        "victimisation": victimisation,
+        "attractiveness": truncated_normal(rng, N),
+        "perceived_guardianship": truncated_normal(rng, N),
+        "perceived_capability": rng.uniform(-5, 6, N), # random number between -5 and 5.
+        "ethnicity": assign_ethnicities(rng, N, ethnic_distribution),
+        "zone": zone,
+    }
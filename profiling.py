@@ -0,0 +1,186 @@
+import functools
+from time import perf_counter
+from collections import defaultdict
+import numpy as np
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Methods timed by the profiler, as (module, class, method). The phase is named Class.method.
+PHASES = (
+    ("ensemble", "Ensemble", "step"),
+    ("model", "Map", "step"),
+    ("agent", "Civilian", "step"),
+    ("agent", "Civilian", "move"),
+    ("agent", "Civilian", "offend"),
+    ("agent", "Civilian", "cop_nearby"),
+    ("agent", "Cop", "step"),
+    ("agent", "Cop", "move"),
+    ("agent", "Cop", "hotspot_node_generator"),
+    ("agent", "Cop", "stopsearch"),
+    ("scheduler", "WakeupActivation", "wake_agents"),
+    ("engine", "VectorEngine", "step"),
+    ("engine", "VectorEngine", "advance"),
+    ("engine", "VectorEngine", "settle"),
+    ("engine", "VectorEngine", "move"),
+    ("engine", "VectorEngine", "index_cells"),
+    ("engine", "VectorEngine", "offend"),
+    ("distributed", "DistributedEngine", "step"),
+    ("distributed", "DistributedEngine", "stopsearch"),
+    ("routing", "Router", "find_path"),
+    ("collector", "StreamingDataCollector", "collect"),
+)
+TICK_PHASES = ("Map.step", "Ensemble.step") # Phases that close a tick; an ensemble steps its replicates without Map.step.
+
+# The profiler whose wrappers are installed, if any.
+_active = None
+
+
+#----------------------------------------------------------------
+class PhaseProfiler:
+    """
+    Accumulates the wall time and number of calls of the PHASES for every tick.
+
+    Enabling the profiler replaces the methods of PHASES on their classes by timed wrappers
+    and disabling it puts the original methods back, so a disabled profiler costs nothing.
+    Times are inclusive (Civilian.offend includes Civilian.cop_nearby) and per agent type, as
+    the phases of civilians and cops are separate. As the methods are replaced on the classes,
+    only one profiler can be enabled at a time and it times every model in the process.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.originals = {}
+        self.time = defaultdict(float) # Time of the current tick per phase.
+        self.calls = defaultdict(int) # Calls of the current tick per phase.
+        self.ticks = [] # (time, calls) of every finished tick.
+
+    def __getstate__(self):
+        """
+        Only the recorded ticks are kept in pickles (checkpoints); the copy is disabled,
+        and was_enabled tells load_checkpoint to enable it again.
+        """
+        return {"enabled": False, "was_enabled": self.enabled, "originals": {}, "time": self.time, "calls": self.calls,
+            "ticks": self.ticks}
+
+    def enable(self):
+        """
+        Installs the timed wrappers.
+        """
+        global _active
+        if self.enabled:
+            return
+        if _active is not None:
+            raise RuntimeError("Another profiler is already enabled")
+        import importlib
+        for module_name, class_name, method_name in PHASES:
+            cls = getattr(importlib.import_module(module_name), class_name)
+            original = cls.__dict__[method_name]
+            self.originals[(cls, method_name)] = original
+            setattr(cls, method_name, self.timed(class_name + "." + method_name, original))
+        self.enabled = True
+        _active = self
+
+    def disable(self):
+        """
+        Puts the original methods back.
+        """
+        global _active
+        if not self.enabled:
+            return
+        for (cls, method_name), original in self.originals.items():
+            setattr(cls, method_name, original)
+        self.originals = {}
+        self.enabled = False
+        _active = None
+
+    def timed(self, name, func):
+        """
+        Returns a wrapper of func that adds its wall time and a call to the phase name.
+        """
+        time, calls = self.time, self.calls
+        closes_tick = name in TICK_PHASES
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                time[name] += perf_counter() - start
+                calls[name] += 1
+                if closes_tick:
+                    self.end_tick()
+        return wrapper
+
+    def end_tick(self):
+        """
+        Stores the times and calls of the current tick and starts a new one.
+        """
+        self.ticks.append((dict(self.time), dict(self.calls)))
+        self.time.clear()
+        self.calls.clear()
+
+    def phases(self):
+        """
+        Returns the names of the phases that were called, in the order of PHASES.
+        """
+        seen = set()
+        for times, _ in self.ticks:
+            seen.update(times)
+        return [c + "." + m for _, c, m in PHASES if c + "." + m in seen]
+
+    def series(self):
+        """
+        Returns the per tick time series: for every phase an array of seconds and an array
+        of calls with one element per tick.
+        """
+        names = self.phases()
+        times = {name: np.zeros(len(self.ticks)) for name in names}
+        calls = {name: np.zeros(len(self.ticks), dtype=np.int64) for name in names}
+        for i, (tick_times, tick_calls) in enumerate(self.ticks):
+            for name, seconds in tick_times.items():
+                times[name][i] = seconds
+                calls[name][i] = tick_calls[name]
+        return {"time": times, "calls": calls}
+
+    def to_dataframe(self):
+        """
+        Returns the per tick time series as a DataFrame with a time and a calls column per phase.
+        """
+        import pandas as pd
+
+        series = self.series()
+        columns = {}
+        for name in series["time"]:
+            columns[name + ".time"] = series["time"][name]
+            columns[name + ".calls"] = series["calls"][name]
+        return pd.DataFrame(columns).rename_axis("tick")
+
+    def summary(self):
+        """
+        Returns one row per phase: calls, total seconds, microseconds per call and the
+        share of the total tick time.
+        """
+        series = self.series()
+        total = sum(series["time"][name].sum() for name in TICK_PHASES if name in series["time"])
+        rows = []
+        for name in series["time"]:
+            seconds = series["time"][name].sum()
+            n_calls = int(series["calls"][name].sum())
+            rows.append({
+                "phase": name,
+                "calls": n_calls,
+                "total_s": float(seconds),
+                "per_call_us": float(seconds / n_calls * 1e6) if n_calls else 0.0,
+                "share": float(seconds / total) if total > 0 else 0.0,
+            })
+        return rows
+
+    def report(self):
+        """
+        Returns the summary as a text table.
+        """
+        lines = ["{:<42} {:>12} {:>10} {:>12} {:>7}".format("phase", "calls", "total s", "us/call", "share")]
+        for row in self.summary():
+            lines.append("{:<42} {:>12} {:>10.3f} {:>12.2f} {:>6.1%}".format(
+                row["phase"], row["calls"], row["total_s"], row["per_call_us"], row["share"]))
+        return "\n".join(lines)
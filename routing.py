@@ -0,0 +1,183 @@
+import heapq
+from collections import OrderedDict
+import numpy as np
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Moves in the same order as the von Neumann neighbourhood of the grid: west, south, north, east.
+MOVES = ((-1, 0), (0, -1), (0, 1), (1, 0))
+JOINED = -1 # A* entry of the destination reached through a cell of a PathTree.
+
+# Number of path cells (about 100 bytes each) kept in memory by a router.
+ROUTE_CACHE_CELLS = 1000000
+
+
+#----------------------------------------------------------------
+class PathTree:
+    """
+    Shortest paths to one destination (a flat cell index) from the cells they were searched from.
+    steps maps a flat cell to the next cell of its path and its number of moves to the destination,
+    or to None if the destination cannot be reached. As the rest of a shortest path is a shortest
+    path as well, the paths of several agents to the destination join and share their cells.
+    """
+    def __init__(self, target):
+        self.target = target
+        self.steps = {}
+
+
+#----------------------------------------------------------------
+class Router:
+    """
+    Finds shortest paths over the road network. Agents walk along roads and may step onto
+    their destination from any neighbouring cell, as in the original movement rules.
+
+    Only the paths that agents walk are searched, with A* from the cell of the agent, so the
+    cost of a route grows with its length and not with the size of the map. The paths are kept
+    in a PathTree per destination, in a least recently used cache of at most cache_cells cells.
+    """
+    def __init__(self, streets, cache_cells=ROUTE_CACHE_CELLS):
+        """
+        Takes the road map of the street layer.
+        """
+        self.width = streets.width
+        self.height = streets.height
+        self.road = streets.road.ravel().astype(np.uint8).tobytes() # Faster to index one cell at a time.
+        self.cells = streets.cells
+        self.cache_cells = cache_cells
+        self.cached_cells = 0 # Cells of the paths in the cache.
+        self.cache = OrderedDict() # The PathTree of every destination, by flat cell index.
+
+    def path_tree(self, target):
+        """
+        Returns the PathTree of a destination (flat cell index).
+        """
+        tree = self.cache.get(target)
+        if tree is not None:
+            self.cache.move_to_end(target)
+            return tree
+        tree = self.cache[target] = PathTree(target)
+        return tree
+
+    def find_path(self, tree, source):
+        """
+        Adds the shortest path from a cell (flat index) to the destination of a tree, and
+        drops the least recently used trees when the cache holds more than cache_cells cells.
+
+        Runs A* from the source, with the manhattan distance to the nearest cell the destination
+        can be entered from (a road next to it, or the source) plus the move onto it. A cell of the
+        tree is not expanded but leads on to the destination with its known number of moves, so a
+        path that joins the tree stops there. Ties go to the cell with the most moves made, then
+        to the lowest flat index, so the search is deterministic.
+        """
+        width, height = self.width, self.height
+        target = tree.target
+        tx, ty = divmod(target, height)
+        road = self.road
+        steps = tree.steps
+        moves = [(dx, dy, dx * height + dy) for dx, dy in MOVES]
+        before = len(steps)
+
+        # The cells the destination is entered from, and the moves left from them.
+        x, y = divmod(source, height)
+        if road[target]:
+            entries = [(tx, ty, 0)]
+        else:
+            entries = [(tx + dx, ty + dy, 1) for dx, dy, delta in moves if 0 <= tx + dx < width
+                and 0 <= ty + dy < height and (road[target + delta] or target + delta == source)]
+
+        def estimate(x, y):
+            return min(abs(x - ex) + abs(y - ey) + extra for ex, ey, extra in entries)
+
+        cell = source
+        made = {source: 0}
+        parent = {source: None}
+        heap = [(estimate(x, y), 0, source)] if entries else []
+        while heap:
+            _, negative_made, cell = heapq.heappop(heap)
+            if cell == target or cell == JOINED:
+                break
+            if -negative_made > made[cell]:
+                continue # Already reached with fewer moves.
+            if cell != source and steps.get(cell) is not None:
+                total = made[cell] + steps[cell][1]
+                if total < made.get(JOINED, np.inf):
+                    made[JOINED] = total
+                    parent[JOINED] = cell
+                    heapq.heappush(heap, (total, -total, JOINED))
+                continue
+            x, y = divmod(cell, height)
+            for dx, dy, delta in moves:
+                nx, ny = x + dx, y + dy
+                if nx < 0 or nx >= width or ny < 0 or ny >= height:
+                    continue
+                neighbour = cell + delta
+                if not road[neighbour] and neighbour != target:
+                    continue # Buildings are only entered when they are the destination.
+                to_neighbour = made[cell] + 1
+                if to_neighbour < made.get(neighbour, np.inf):
+                    made[neighbour] = to_neighbour
+                    parent[neighbour] = cell
+                    heapq.heappush(heap, (to_neighbour + (0 if neighbour == target else estimate(nx, ny)), -to_neighbour, neighbour))
+        else:
+            steps[source] = None # The destination cannot be reached.
+        if cell == target or cell == JOINED:
+            # Walk back from the destination, or from the cell where the path joins the tree.
+            if cell == JOINED:
+                end = parent[JOINED]
+                remaining = steps[end][1]
+            else:
+                end, remaining = target, 0
+            path = [end]
+            while parent[path[-1]] is not None:
+                path.append(parent[path[-1]])
+            for i in range(1, len(path)):
+                steps[path[i]] = (path[i - 1], remaining + i)
+
+        # Keep the tree being walked, the most recently used one.
+        self.cached_cells += len(steps) - before
+        while self.cached_cells > self.cache_cells and len(self.cache) > 1:
+            _, dropped = self.cache.popitem(last=False)
+            self.cached_cells -= len(dropped.steps)
+
+    def next_cell(self, cell, target):
+        """
+        Returns the next cell (flat index) on the shortest path from a cell to a destination,
+        or None if the cell is the destination or the destination cannot be reached.
+        """
+        if cell == target:
+            return None
+        tree = self.path_tree(target)
+        if cell not in tree.steps:
+            self.find_path(tree, cell)
+        step = tree.steps[cell]
+        if step is None:
+            return None
+        return step[0]
+
+    def next_cells(self, cells, targets):
+        """
+        Returns the next cell of every cell on its path to a destination (lists of flat indices),
+        as next_cell, with the cell itself where there is no next cell.
+        """
+        cache = self.cache
+        steps = []
+        for cell, target in zip(cells, targets):
+            tree = cache.get(target)
+            step = tree.steps.get(cell) if tree is not None else None
+            if step is None:
+                step = self.next_cell(cell, target)
+                steps.append(cell if step is None else step)
+            else:
+                cache.move_to_end(target)
+                steps.append(step[0])
+        return steps
+
+    def next_step(self, pos, destination):
+        """
+        Returns the next cell on the shortest path from pos to destination,
+        or None if the destination cannot be reached.
+        """
+        cell = self.next_cell(pos[0] * self.height + pos[1], destination[0] * self.height + destination[1])
+        if cell is None:
+            return None
+        return self.cells[cell]
@@ -0,0 +1,61 @@
+import heapq
+from mesa.time import RandomActivation
+
+
+#----------------------------------------------------------------
+class WakeupActivation(RandomActivation):
+    """
+    A RandomActivation scheduler that can park agents that have nothing to do until a later tick.
+
+    Parked agents are kept in a priority queue keyed by their wake-up tick and are not stepped.
+    When the wake-up tick arrives they are told how many ticks they skipped (agent.wake) and
+    are activated again, in random order together with the other active agents.
+    """
+    def __init__(self, model):
+        super().__init__(model)
+        self.parked = {} # unique_id -> (agent, tick it was parked)
+        self.wakeups = [] # heap of (wake-up tick, unique_id)
+
+    def park(self, agent, ticks):
+        """
+        Parks an agent during its step so that it is stepped again in the given number of ticks.
+        """
+        del self._agents[agent.unique_id]
+        self.parked[agent.unique_id] = (agent, self.steps)
+        heapq.heappush(self.wakeups, (self.steps + ticks, agent.unique_id))
+
+    def wake_agents(self):
+        """
+        Activates the parked agents whose wake-up tick has arrived.
+        """
+        while self.wakeups and self.wakeups[0][0] <= self.steps:
+            _, unique_id = heapq.heappop(self.wakeups)
+            agent, parked_at = self.parked.pop(unique_id)
+            agent.wake(self.steps - parked_at - 1)
+            self._agents[unique_id] = agent
+
+    def step(self):
+        """
+        Wakes the agents that are due and steps all active agents in random order.
+        """
+        self.wake_agents()
+        super().step()
+
+    def remove(self, agent):
+        if agent.unique_id in self.parked:
+            del self.parked[agent.unique_id]
+            self.wakeups = [w for w in self.wakeups if w[1] != agent.unique_id]
+            heapq.heapify(self.wakeups)
+        else:
+            super().remove(agent)
+
+    def get_agent_count(self):
+        return len(self._agents) + len(self.parked)
+
+    def get_active_count(self):
+        """Returns the number of agents that are stepped this tick."""
+        return len(self._agents)
+
+    @property
+    def agents(self):
+        return list(self._agents.values()) + [agent for agent, _ in self.parked.values()]
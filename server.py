@@ -1,11 +1,15 @@
 from model import *
 from agent import *
-import pandas as pd
-from mesa import batchrunner
-from mesa.visualization.modules import CanvasGrid
-from mesa.visualization.modules import ChartModule
+from sweep import run_sweep, run_adaptive_sweep, load_sweep
+from layout import load_layout
+import os
+import threading
+import numpy as np
+import tornado.escape
+from mesa.visualization.ModularVisualization import VisualizationElement
+from mesa.visualization.modules import ChartModule, TextElement
 from mesa.visualization.UserParam import UserSettableParameter
-from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler
 from multiprocessing import freeze_support
 
 #----------------------------------------
@@ -23,71 +27,343 @@ ETHNIC_DISTRIBUTION = 2
 # 1 = Homogenous distribution
 # 2 = Uniform distribution
 
+# Sweep parameters:
+STRATEGIC_LEVELS = [10] # Percentages of strategic cops to run.
+ETHNIC_DISTRIBUTIONS = [ETHNIC_DISTRIBUTION] # Ethnic distributions to run.
+SWEEP_DIR = "sweep_runs" # Directory of the run files.
+BASE_SEED = 0 # Seed from which the seed of every run is derived.
+SUMMARISE_RUNS = True # Write a summary of every run (by ethnicity and zone) instead of its civilian rows.
+SAMPLE_ROWS = 0 # Civilian rows of every summarised run also written, to SWEEP_DIR/samples.
+TARGET_WIDTH = None # If set, run each configuration until its confidence intervals are this narrow (relative to the mean), up to ITERATIONS runs.
+
 CPU = 2
 # 1 = Cluster
 # 2 = Local
 
+# Background server parameters:
+TICKS_PER_FRAME = 60 # Ticks the model runs between two frames (one hour).
+MAX_TICKS_PER_FRAME = 1440 # One day.
+LIVE_PARAMS = {"N_strategic_cops": "set_strategic_cops"} # Parameters applied to the running model.
+
 # Option for how the model should run:
 OPTION = 2 
 #1 = visualisation
 #2 = batch_run
 
-if OPTION == 1: # Initiate the server through jupyter in browser to visualise.
-    #----------------------------------------
-    # Design the agent portrayal
-    def agent_portrayal(agent):
-        portrayal = {
-            "Filled": "true",
-            "r": 0.5} 
-        
-        if agent.typ == "building":
-                portrayal["Shape"] = "rect"
-                portrayal["Color"] = "#2ECC71"
-                portrayal["Layer"] = 0
-                portrayal["w"] = 1
-                portrayal["h"] = 1
-            
-        elif agent.typ == "road":
-                portrayal["Shape"] = "rect"
-                portrayal["Color"] = "#CACFD2" 
-                portrayal["Layer"] = 1
-                portrayal["w"] = 1
-                portrayal["h"] = 1                    
-
-        elif agent.typ == "civilian":
-            if agent.chronic_offender == True:
-                portrayal["Shape"] = "circle"
-                portrayal["Color"] = "red"
-                portrayal["Layer"] = 2
-                portrayal["r"] = 1
-            elif agent.chronic_offender == False and agent.criminal_propensity > 0:
-                portrayal["Shape"] = "circle"
-                portrayal["Color"] = "#B12702"
-                portrayal["Layer"] = 2
-                portrayal["r"] = 1
-            else:
-                portrayal["Shape"] = "circle"
-                portrayal["Color"] = "#C2654C"
-                portrayal["Layer"] = 2
-                portrayal["r"] = 1
-        elif agent.typ == "cop":
-            if agent.hotspot_patrol:
-                portrayal["Shape"] = "circle"
-                portrayal["Color"] = "#5B2C6F"
-                portrayal["Layer"] = 2
-                portrayal["r"] = 1
+#----------------------------------------
+# Design the agent portrayal
+def street_portrayal(typ):
+    portrayal = {
+        "Filled": "true",
+        "r": 0.5} 
+
+    if typ == "building":
+            portrayal["Shape"] = "rect"
+            portrayal["Color"] = "#2ECC71"
+            portrayal["Layer"] = 0
+            portrayal["w"] = 1
+            portrayal["h"] = 1
+
+    elif typ == "road":
+            portrayal["Shape"] = "rect"
+            portrayal["Color"] = "#CACFD2" 
+            portrayal["Layer"] = 1
+            portrayal["w"] = 1
+            portrayal["h"] = 1                    
+    return portrayal
+
+def agent_portrayal(agent):
+    portrayal = {
+        "Filled": "true",
+        "r": 0.5} 
+
+    if agent.typ == "civilian":
+        if agent.chronic_offender == True:
+            portrayal["Shape"] = "circle"
+            portrayal["Color"] = "red"
+            portrayal["Layer"] = 2
+            portrayal["r"] = 1
+        elif agent.chronic_offender == False and agent.criminal_propensity > 0:
+            portrayal["Shape"] = "circle"
+            portrayal["Color"] = "#B12702"
+            portrayal["Layer"] = 2
+            portrayal["r"] = 1
+        else:
+            portrayal["Shape"] = "circle"
+            portrayal["Color"] = "#C2654C"
+            portrayal["Layer"] = 2
+            portrayal["r"] = 1
+    elif agent.typ == "cop":
+        if agent.hotspot_patrol:
+            portrayal["Shape"] = "circle"
+            portrayal["Color"] = "#5B2C6F"
+            portrayal["Layer"] = 2
+            portrayal["r"] = 1
+        else:
+            portrayal["Shape"] = "circle"
+            portrayal["Color"] = "blue"
+            portrayal["Layer"] = 2
+            portrayal["r"] = 1
+    return portrayal
+
+class StreetCanvas(VisualizationElement):
+    """
+    Draws the street layer and the agents on a canvas in the browser (street_canvas.js).
+
+    The street layer and the styles of the agents are only sent in the first frame of a
+    model; the browser keeps the street layer as an image. The following frames only send
+    the agents that moved since the last frame sent to the same client (browser connection).
+    Every new model (the browser resets the model when it connects) starts with a full frame,
+    and so does the next frame of every client after restyle.
+    """
+    def __init__(self, portrayal_method, grid_width, grid_height, canvas_width=500, canvas_height=500):
+        self.portrayal_method = portrayal_method
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "street_canvas.js")) as f:
+            script = f.read()
+        self.js_code = script + "elements.push(new StreetCanvas({}, {}, {}, {}));".format(
+            canvas_width, canvas_height, grid_width, grid_height)
+        self.frames = {} # The model, positions and style version of the last frame of each client.
+        self.style_version = 0
+
+    def agents(self, model):
+        """
+        Returns the agents to draw, civilians first, in a fixed order.
+        """
+        if model.engine is not None:
+            return model.engine.views() + model.cops
+        return model.civilians + model.cops
+
+    def positions(self, model):
+        """
+        Returns the x and y coordinates of the agents as arrays.
+        """
+        if model.engine is not None:
+            x, y = np.divmod(model.engine.pos, model.engine.height)
+        else:
+            x = np.array([a.pos[0] for a in model.civilians], dtype=np.int64)
+            y = np.array([a.pos[1] for a in model.civilians], dtype=np.int64)
+        x = np.concatenate([x, [a.pos[0] for a in model.cops]]).astype(np.int64)
+        y = np.concatenate([y, [a.pos[1] for a in model.cops]]).astype(np.int64)
+        return x, y
+
+    def render(self, model, client=None):
+        x, y = self.positions(model)
+        last = self.frames.get(client)
+        self.frames[client] = (model, x, y, self.style_version)
+        if last is None or last[0] is not model or len(x) != len(last[1]) or last[3] != self.style_version:
+            return self.full_frame(model, x, y)
+
+        moved = np.flatnonzero((x != last[1]) | (y != last[2]))
+        return {"full": False, "moved": moved.tolist(), "x": x[moved].tolist(), "y": y[moved].tolist()}
+
+    def restyle(self):
+        """
+        Sends the styles again in the next frame of every client, after the agents changed style.
+        """
+        self.style_version += 1
+
+    def forget(self, client):
+        """
+        Drops the last frame of a client that disconnected.
+        """
+        self.frames.pop(client, None)
+
+    def full_frame(self, model, x, y):
+        """
+        Returns the street layer, the styles and the positions (x, y) of all agents.
+        """
+        styles = {}
+        style = []
+        for agent in self.agents(model):
+            portrayal = self.portrayal_method(agent)
+            key = (portrayal["Color"], portrayal["r"])
+            style.append(styles.setdefault(key, len(styles)))
+        return {
+            "full": True,
+            "street": "".join(np.where(model.streets.road.ravel(), "r", "b")),
+            "road_color": street_portrayal("road")["Color"],
+            "building_color": street_portrayal("building")["Color"],
+            "styles": [{"Color": color, "r": r} for color, r in styles],
+            "x": x.tolist(),
+            "y": y.tolist(),
+            "style": style,
+        }
+
+
+class TickText(TextElement):
+    """
+    Shows the tick of the model.
+    """
+    def render(self, model):
+        return "Tick: {}".format(model.schedule.steps)
+
+
+class StreetSocketHandler(SocketHandler):
+    """
+    A SocketHandler that renders the frames of its own connection (see StreetCanvas).
+    """
+    @property
+    def viz_state_message(self):
+        return {"type": "viz_state", "data": self.application.render_model(client=self)}
+
+    def on_close(self):
+        self.application.forget_client(self)
+
+
+class StreetServer(ModularServer):
+    """
+    A ModularServer whose StreetCanvas elements send every browser connection the moves
+    since the last frame of that connection.
+    """
+    socket_handler = (r"/ws", StreetSocketHandler)
+    handlers = [ModularServer.page_handler, socket_handler, ModularServer.static_handler, ModularServer.local_handler]
+
+    def render_model(self, client=None):
+        return [element.render(self.model, client) if isinstance(element, StreetCanvas) else element.render(self.model)
+            for element in self.visualization_elements]
+
+    def forget_client(self, client):
+        for element in self.visualization_elements:
+            if isinstance(element, StreetCanvas):
+                element.forget(client)
+
+    def restyle(self):
+        """
+        Sends the styles of the agents again, after a change of the running model.
+        """
+        for element in self.visualization_elements:
+            if isinstance(element, StreetCanvas):
+                element.restyle()
+
+
+class BackgroundSocketHandler(StreetSocketHandler):
+    """
+    Sends the current state of the background model for every frame instead of stepping it.
+    """
+    def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        app = self.application
+
+        if msg["type"] == "get_step":
+            with app.lock:
+                if not app.model.running:
+                    self.write_message({"type": "end"})
+                    return
+                state = app.render_model(client=self)
+                app.request_ticks()
+            self.write_message({"type": "viz_state", "data": state})
+
+        elif msg["type"] == "reset":
+            with app.lock:
+                app.reset_model()
+                state = app.render_model(client=self)
+            self.write_message({"type": "viz_state", "data": state})
+
+        elif msg["type"] == "submit_params":
+            app.set_param(msg["param"], msg["value"])
+
+
+class BackgroundServer(StreetServer):
+    """
+    A ModularServer whose model runs in a background thread.
+
+    For every frame the browser gets the current state and the model runs on for
+    ticks_per_frame ticks (a slider) while the frame is drawn. If the browser asks for the
+    next frame before these ticks are done it gets the state reached so far. Changes to the
+    LIVE_PARAMS sliders are applied to the running model between two ticks; other parameters
+    are used when the model is reset.
+    """
+    socket_handler = (r"/ws", BackgroundSocketHandler)
+    handlers = [StreetServer.page_handler, socket_handler, StreetServer.static_handler, StreetServer.local_handler]
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model", model_params={}, ticks_per_frame=TICKS_PER_FRAME):
+        self.lock = threading.Condition()
+        self.ticks_due = 0
+        self.pending = {}
+        self.ticks_per_frame = UserSettableParameter(param_type="slider",
+            value=ticks_per_frame,
+            name="Ticks per frame",
+            min_value=1,
+            max_value=MAX_TICKS_PER_FRAME,
+            step=1,
+            description="Number of ticks the model runs between two frames")
+        super().__init__(model_cls, visualization_elements, name, model_params)
+        self.worker = threading.Thread(target=self.run_model, daemon=True)
+        self.worker.start()
+
+    @property
+    def user_params(self):
+        result = super().user_params
+        result["ticks_per_frame"] = self.ticks_per_frame.json
+        return result
+
+    def reset_model(self):
+        with self.lock:
+            super().reset_model()
+            self.ticks_due = 0
+            self.pending = {}
+
+    def request_ticks(self):
+        """
+        Lets the model run ticks_per_frame ticks.
+        """
+        with self.lock:
+            self.ticks_due = self.ticks_per_frame.value
+            self.lock.notify()
+
+    def set_param(self, param, value):
+        """
+        Changes a slider: the ticks per frame, a parameter of the next model, and for
+        LIVE_PARAMS also the running model.
+        """
+        with self.lock:
+            if param == "ticks_per_frame":
+                self.ticks_per_frame.value = int(value)
+                return
+            if param not in self.model_kwargs:
+                return
+            if isinstance(self.model_kwargs[param], UserSettableParameter):
+                self.model_kwargs[param].value = value
             else:
-                portrayal["Shape"] = "circle"
-                portrayal["Color"] = "blue"
-                portrayal["Layer"] = 2
-                portrayal["r"] = 1
-        return portrayal
+                self.model_kwargs[param] = value
+            if param in LIVE_PARAMS:
+                self.pending[param] = value
+
+    def run_model(self):
+        """
+        Steps the model whenever ticks are due, applying the pending parameter changes first.
+        """
+        while True:
+            with self.lock:
+                while self.ticks_due == 0 or not self.model.running:
+                    self.lock.wait()
+                for param, value in self.pending.items():
+                    getattr(self.model, LIVE_PARAMS[param])(value)
+                if self.pending:
+                    self.restyle() # The cops may have changed patrol, and colour.
+                self.pending = {}
+                self.model.step()
+                self.ticks_due -= 1
+
+
+def make_server(N=N_AGENTS, NC=N_COPS, width=WIDTH, height=HEIGHT, ethnic_distribution=ETHNIC_DISTRIBUTION,
+    zonal_hotspots=False, vectorised=False, crime_half_life=None, layout=None, port=8521, background=False,
+    ticks_per_frame=TICKS_PER_FRAME):
+    """
+    Sets up the visualisation server. With background=True the model runs in a background
+    thread, ticks_per_frame ticks per frame (BackgroundServer). The size of a layout
+    (a Layout or the directory of its files) replaces width and height.
+    """
+    if isinstance(layout, str):
+        layout = load_layout(layout)
+    if layout is not None:
+        width, height = layout.width, layout.height
 
     # Create the grid with the agent design
-    grid = CanvasGrid(
+    grid = StreetCanvas(
         agent_portrayal, 
-        WIDTH,
-        HEIGHT, 
+        width,
+        height, 
         800,
         800)
 
@@ -107,101 +383,95 @@ if OPTION == 1: # Initiate the server through jupyter in browser to visualise.
         step= 10, 
         description="Percentage of cops that are patrolling hotspots"
         ),
-        "N": N_AGENTS, 
-        "NC": N_COPS, 
-        "width": WIDTH, 
-        "height": HEIGHT,
-        "ethnic_distribution": ETHNIC_DISTRIBUTION
+        "N": N, 
+        "NC": NC, 
+        "width": width, 
+        "height": height,
+        "ethnic_distribution": ethnic_distribution,
+        "zonal_hotspots": zonal_hotspots,
+        "vectorised": vectorised,
+        "crime_half_life": crime_half_life,
+        "layout": layout,
+        "collect_period": 0 # Only the series of the chart; civilian rows would fill the memory of a long run.
     }
 
     # Set up the server
-    server = ModularServer(Map,
-                        [grid, chart],
-                        "Hot Spots Policing",
-                        model_params
-                        )
-
+    if background:
+        server = BackgroundServer(Map,
+                            [TickText(), grid, chart],
+                            "Hot Spots Policing",
+                            model_params,
+                            ticks_per_frame
+                            )
+    else:
+        server = StreetServer(Map,
+                            [grid, chart],
+                            "Hot Spots Policing",
+                            model_params
+                            )
+    server.port = port
+    return server
 
-    # Initiate the server through jupyter in browser to visualise.
-    server.port = 8521 # The default
-    server.launch()
 
-elif OPTION == 2: # Collect data through batchrunner without visualisation:
-        # Dictionary of user settable parameters - these map to the model __init__ parameters
+def run_batch(processes):
+    """
+    Runs the sweep of the module constants and writes simulation_summary.csv
+    (with SUMMARISE_RUNS) or simulation_data.csv.
+    """
     model_params = {
-        # Slider for adjusting number of hot spots police
-        "N_strategic_cops": 10,
         "N": N_AGENTS, 
         "NC": N_COPS, 
         "width": WIDTH, 
-        "height": HEIGHT,
-        "ethnic_distribution": ETHNIC_DISTRIBUTION
+        "height": HEIGHT
     }
 
-    model_run = Map(model_params["N"], 
-    model_params["NC"], 
-    model_params["width"], 
-    model_params["height"], 
-    model_params["N_strategic_cops"],
-    model_params["ethnic_distribution"])
-
-    if CPU == 1:
-        done = False
-        if __name__ == '__main__':
-            freeze_support()
-            results_batch = batchrunner.batch_run(
-                Map,
-                model_params,
-                iterations = ITERATIONS, 
-                number_processes= None,
-                data_collection_period = COLLECT_DATA,
-                display_progress= True
-            )
-            done = True
-
-        if done == True:
-            results_batch_df = pd.DataFrame(results_batch)
-            results_batch_df = results_batch_df.loc[:, results_batch_df.columns.intersection([
-            'iteration',
-            'Step',
-            'N_strategic_cops', 
-            'Victimised', 
-            'Stopped_Searched',
-            'AgentID',
-            'Ethnicity',
-            'zone',
-            'N_victimised',
-            'N_stop_searched',
-            'ethnic_distribution'])]
-            #results_batch_df = results_batch_df[results_batch_df['AgentID'] < 30000]
-            results_batch_df = results_batch_df[results_batch_df['AgentID'] < 15000]
-            results_batch_df.to_csv("simulation_data.csv")
-    
-    if CPU == 2:
-        results_batch = batchrunner.batch_run(
-                Map,
-                model_params,
-                iterations = ITERATIONS, 
-                number_processes= 1,
-                data_collection_period = COLLECT_DATA,
-                display_progress= True
-            )
-
-        results_batch_df = pd.DataFrame(results_batch)
-        results_batch_df = results_batch_df.loc[:, results_batch_df.columns.intersection([
-            'iteration',
-            'Step',
-            'N_strategic_cops', 
-            'Victimised', 
-            'Stopped_Searched',
-            'AgentID',
-            'Ethnicity',
-            'zone',
-            'N_victimised',
-            'N_stop_searched',
-            'ethnic_distribution'])]
-        #results_batch_df = results_batch_df[results_batch_df['AgentID'] < 30000]
-        results_batch_df = results_batch_df[results_batch_df['AgentID'] < 15000]
-        results_batch_df.to_csv("simulation_data.csv")
-        # print(results_batch_df.keys())
-        # print(results_batch_df.tail())
\ No newline at end of file
+    # Every run is written to SWEEP_DIR as it finishes; runs already there are skipped if they
+    # have the same settings, and the sweep refuses to start if they have not.
+    if TARGET_WIDTH is None:
+        run_sweep(
+            model_params,
+            STRATEGIC_LEVELS,
+            ETHNIC_DISTRIBUTIONS,
+            ITERATIONS,
+            SWEEP_DIR,
+            processes=processes,
+            base_seed=BASE_SEED,
+            data_collection_period=COLLECT_DATA,
+            display_progress=True,
+            summarised=SUMMARISE_RUNS,
+            sample_rows=SAMPLE_ROWS
+        )
+    else:
+        run_adaptive_sweep(
+            model_params,
+            STRATEGIC_LEVELS,
+            ETHNIC_DISTRIBUTIONS,
+            SWEEP_DIR,
+            target_width=TARGET_WIDTH,
+            max_iterations=ITERATIONS,
+            processes=processes,
+            base_seed=BASE_SEED,
+            data_collection_period=COLLECT_DATA,
+            display_progress=True,
+            summarised=SUMMARISE_RUNS,
+            sample_rows=SAMPLE_ROWS
+        )
+
+    results_batch_df = load_sweep(SWEEP_DIR)
+    if SUMMARISE_RUNS:
+        results_batch_df.to_csv("simulation_summary.csv", index=False)
+        return
+    #results_batch_df = results_batch_df[results_batch_df['AgentID'] < 30000]
+    results_batch_df = results_batch_df[results_batch_df['AgentID'] < 15000]
+    results_batch_df.to_csv("simulation_data.csv")
+
+
+if __name__ == '__main__':
+    freeze_support()
+    if OPTION == 1: # Initiate the server through jupyter in browser to visualise.
+        make_server().launch()
+    elif OPTION == 2: # Collect data without visualisation:
+        if CPU == 1:
+            run_batch(processes=None) # All cores
+        else:
+            run_batch(processes=1)
@@ -0,0 +1,162 @@
+import copy
+import numpy as np
+from hotspots import HotspotIndex
+from density import CrimeDensity
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Value returned as the risk of a cell that is not a road (robbery is not possible there).
+NO_ROAD_RISK = 10
+
+
+#----------------------------------------------------------------
+class CellTable:
+    """
+    The shared (x, y) tuple of every cell, indexed by flat cell index. A tuple is made when
+    its cell is first used, so a large map does not make one per cell up front.
+    """
+    def __init__(self, width, height):
+        self.height = height
+        self.tuples = [None] * (width * height)
+
+    def __getitem__(self, flat):
+        cell = self.tuples[flat]
+        if cell is None:
+            cell = self.tuples[flat] = divmod(int(flat), self.height)
+        return cell
+
+    def __iter__(self):
+        """
+        Iterates over the tuples that have been made.
+        """
+        return (cell for cell in self.tuples if cell is not None)
+
+
+#----------------------------------------------------------------
+class StreetLayer:
+    """
+    The static street map of the city. Every cell is either a road or a building and
+    its attributes are stored in arrays indexed by [x, y] instead of one agent per cell.
+    """
+    def __init__(self, layout, crime_half_life=None):
+        """
+        Takes the roads, risk and zones (grid_nr) of a layout with a risk surface and creates
+        the crime counters. With a crime_half_life (ticks) hot spots are the roads with the
+        highest decayed crime density instead of the most crime incidents.
+        """
+        self.layout = layout
+        self.width = layout.width
+        self.height = layout.height
+        self.n_zones = layout.n_zones
+        self.cells = CellTable(self.width, self.height)
+        self.road = layout.road
+        self.risk = layout.risk
+        self.grid_nr = layout.zones # The zone of each section of the map.
+        self.crime_incidents = np.zeros((self.width, self.height), dtype=np.int64)
+        self.build_node_pools()
+        self.build_hotspot_index()
+        self.kernels = {}
+        self.crime_half_life = crime_half_life
+        self.density = CrimeDensity(self.grid_nr, crime_half_life) if crime_half_life else None
+
+    def replicate(self):
+        """
+        Returns a street layer on the same map, sharing its arrays, node pools and cell tuples,
+        with crime counters of its own.
+        """
+        streets = copy.copy(self)
+        streets.crime_incidents = np.zeros((self.width, self.height), dtype=np.int64)
+        streets.build_hotspot_index()
+        streets.density = CrimeDensity(self.grid_nr, self.crime_half_life) if self.crime_half_life else None
+        return streets
+
+    def cell(self, flat):
+        """
+        Returns the (x, y) position of a flat cell index.
+        """
+        return self.cells[flat]
+
+    def road_risk(self, pos):
+        """
+        Returns the risk of the cell if it is a road, otherwise NO_ROAD_RISK.
+        """
+        if self.road[pos]:
+            return int(self.risk[pos])
+        return NO_ROAD_RISK
+
+    def kernel(self, radius):
+        """
+        Returns the offsets (dx, dy) of the cells within a manhattan distance of radius.
+        """
+        offsets = self.kernels.get(radius)
+        if offsets is None:
+            steps = np.arange(-radius, radius + 1)
+            dx, dy = np.meshgrid(steps, steps, indexing="ij")
+            inside = np.abs(dx) + np.abs(dy) <= radius
+            offsets = (dx[inside], dy[inside])
+            self.kernels[radius] = offsets
+        return offsets
+
+    def record_crime(self, pos, radius=2, tick=0):
+        """
+        Adds one crime incident to every road within the radius of the robbery,
+        and the crime to the density surface at the tick.
+        """
+        dx, dy = self.kernel(radius)
+        xs = dx + pos[0]
+        ys = dy + pos[1]
+        on_map = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        xs, ys = xs[on_map], ys[on_map]
+        roads = self.road[xs, ys]
+        xs, ys = xs[roads], ys[roads]
+        self.crime_incidents[xs, ys] += 1
+        cells = xs * self.height + ys
+        for cell in cells.tolist():
+            self.hotspots.increment(cell)
+            self.zone_hotspots[int(self.grid_nr.flat[cell])].increment(cell)
+        if self.density is not None:
+            self.density.add(cells, tick)
+
+    def build_hotspot_index(self):
+        """
+        Builds the hot spot index of all roads and of the roads in each zone.
+        """
+        self.hotspots = HotspotIndex()
+        self.zone_hotspots = {zone: HotspotIndex() for zone in range(1, self.n_zones + 1)}
+
+    def top_hotspots(self, k=5, zone=None):
+        """
+        Returns the positions of the k roads with the most crime incidents (or the highest
+        crime density), in the whole city or only in one zone.
+        """
+        if self.density is not None:
+            return [self.cells[cell] for cell in self.density.top(k, zone)]
+        if zone is None:
+            index = self.hotspots
+        else:
+            index = self.zone_hotspots[zone]
+        return [self.cells[cell] for cell in index.top(k)]
+
+    def build_node_pools(self):
+        """
+        Builds the index arrays of buildings, risky buildings (risk > 0) and roads
+        for every zone, so that nodes can be sampled without scanning the map.
+        """
+        self.node_pools = {}
+        building = ~self.road
+        risky = building & (self.risk > 0)
+        for zone in range(1, self.n_zones + 1):
+            in_zone = self.grid_nr == zone
+            self.node_pools[(zone, "building")] = np.argwhere(in_zone & building)
+            self.node_pools[(zone, "risky")] = np.argwhere(in_zone & risky)
+            self.node_pools[(zone, "road")] = np.argwhere(in_zone & self.road)
+
+    def random_node(self, rng, zone, kind="building"):
+        """
+        Returns a random cell of the given kind ("building", "risky" or "road") in a zone.
+        """
+        pool = self.node_pools[(zone, kind)]
+        if len(pool) == 0:
+            raise IndexError("Cannot choose from an empty sequence")
+        x, y = pool[rng.randrange(len(pool))]
+        return self.cells[x * self.height + y]
@@ -0,0 +1,78 @@
+/*
+StreetCanvas: draws the street layer once into an offscreen canvas and the agents on top of it.
+
+A full frame (data.full) carries the street layer ("street": one character per cell in
+[x][y] order, "r" for road and "b" for building), the colours of both, the agent styles
+and the position and style of every agent. Other frames only carry the indices of the
+agents that moved and their new positions.
+*/
+var StreetCanvas = function(canvas_width, canvas_height, grid_width, grid_height) {
+	var canvas_tag = `<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`;
+	var parent_div_tag = '<div style="height:' + canvas_height + 'px;" class="world-grid-parent"></div>';
+	var canvas = $(canvas_tag)[0];
+	var parent = $(parent_div_tag)[0];
+	$("#elements").append(parent);
+	parent.append(canvas);
+	var context = canvas.getContext("2d");
+
+	var background = document.createElement("canvas");
+	background.width = canvas_width;
+	background.height = canvas_height;
+	var background_context = background.getContext("2d");
+
+	var cellWidth = Math.floor(canvas_width / grid_width);
+	var cellHeight = Math.floor(canvas_height / grid_height);
+	var maxR = Math.min(cellHeight, cellWidth) / 2 - 1;
+
+	var styles = [];
+	var x = [];
+	var y = [];
+	var style = [];
+
+	var drawStreets = function(data) {
+		background_context.clearRect(0, 0, canvas_width, canvas_height);
+		for (var i = 0; i < data.street.length; i++) {
+			var cx = Math.floor(i / grid_height);
+			var cy = grid_height - (i % grid_height) - 1; // The canvas y axis points down.
+			background_context.fillStyle = data.street[i] == "r" ? data.road_color : data.building_color;
+			background_context.fillRect(cx * cellWidth, cy * cellHeight, cellWidth, cellHeight);
+		}
+	};
+
+	var drawAgents = function() {
+		for (var k = 0; k < x.length; k++) {
+			var s = styles[style[k]];
+			var cx = (x[k] + 0.5) * cellWidth;
+			var cy = (grid_height - y[k] - 0.5) * cellHeight;
+			context.beginPath();
+			context.arc(cx, cy, maxR * s.r, 0, Math.PI * 2, false);
+			context.fillStyle = s.Color;
+			context.fill();
+		}
+	};
+
+	this.render = function(data) {
+		if (data.full) {
+			drawStreets(data);
+			styles = data.styles;
+			x = data.x;
+			y = data.y;
+			style = data.style;
+		} else {
+			for (var i = 0; i < data.moved.length; i++) {
+				x[data.moved[i]] = data.x[i];
+				y[data.moved[i]] = data.y[i];
+			}
+		}
+		context.clearRect(0, 0, canvas_width, canvas_height);
+		context.drawImage(background, 0, 0);
+		drawAgents();
+	};
+
+	this.reset = function() {
+		context.clearRect(0, 0, canvas_width, canvas_height);
+		x = [];
+		y = [];
+		style = [];
+	};
+};
@@ -0,0 +1,475 @@
+import os
+import json
+import random
+import hashlib
+import itertools
+from multiprocessing import Pool
+import numpy as np
+import scipy.stats as sct
+from tqdm import tqdm
+from model import Map, RUN_LENGTH, MONTH
+from population import ETHNICITIES
+from layout import Layout
+
+# GLOBAL VARIABLES:
+#--------------------------------------------------------------------------
+# Columns written for every run, as in the batch run output.
+RUN_COLUMNS = [
+    'iteration',
+    'Step',
+    'N_strategic_cops',
+    'Victimised',
+    'Stopped_Searched',
+    'AgentID',
+    'Ethnicity',
+    'zone',
+    'N_victimised',
+    'N_stop_searched',
+    'ethnic_distribution']
+
+# Sequential stopping: replicates are added to a configuration until the confidence interval
+# of every metric of run_metrics is at most CI_TARGET_WIDTH times its mean.
+CI_CONFIDENCE = 0.95
+CI_TARGET_WIDTH = 0.1
+MIN_ITERATIONS = 5 # Replicates of every configuration before the intervals are checked.
+MAX_ITERATIONS = 100 # Replicates of a configuration that does not converge.
+
+# File with the replicates, means and interval widths of every configuration of an adaptive sweep.
+CONVERGENCE_FILE = "convergence.csv"
+
+# Run summaries: civilians victimised 0 to REPEAT_VICTIMISATION_MAX - 1 times are counted apart,
+# the rest together. Sampled civilian rows are written to SAMPLE_DIR in the sweep directory.
+REPEAT_VICTIMISATION_MAX = 5
+SAMPLE_DIR = "samples"
+
+# File with the settings of the runs of a sweep, checked when the sweep is restarted.
+MANIFEST_FILE = "sweep.json"
+
+
+def run_key(params, iteration):
+    """
+    Returns the name of a run, which is also the name of its result file.
+    """
+    return "cops{:03d}_eth{}_it{:03d}".format(params["N_strategic_cops"], params["ethnic_distribution"], iteration)
+
+
+def sweep_manifest(model_params, base_seed, max_steps, data_collection_period, summarised, sample_rows):
+    """
+    Returns the settings the runs of a sweep depend on, in JSON types: the model parameters
+    (but the swept strategic cop level and ethnic distribution, which are in the run names)
+    and the options of the runs. A layout is given by its size and a hash of its arrays.
+    """
+    params = {name: value for name, value in model_params.items() if name not in ("N_strategic_cops", "ethnic_distribution")}
+    layout = params.get("layout")
+    if isinstance(layout, Layout):
+        digest = hashlib.sha1()
+        for array in (layout.road, layout.zones, layout.risk):
+            if array is not None:
+                digest.update(np.ascontiguousarray(array).tobytes())
+        params["layout"] = {"width": layout.width, "height": layout.height, "sha1": digest.hexdigest()}
+    elif isinstance(layout, str):
+        params["layout"] = os.path.abspath(layout)
+    manifest = {
+        "model_params": params,
+        "base_seed": base_seed,
+        "max_steps": max_steps,
+        "data_collection_period": data_collection_period,
+        "summarised": summarised,
+        "sample_rows": sample_rows,
+    }
+    return json.loads(json.dumps(manifest)) # Tuples as lists, as read back from the file.
+
+
+def check_manifest(out_dir, manifest):
+    """
+    Writes the manifest of a sweep to out_dir or, if the sweep is restarted, checks it against
+    the manifest there, so that the runs of different settings are never mixed in one directory.
+    """
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != manifest:
+            changed = sorted(name for name in set(previous) | set(manifest) if previous.get(name) != manifest.get(name))
+            if "model_params" in changed:
+                old, new = previous.get("model_params", {}), manifest["model_params"]
+                changed.remove("model_params")
+                changed += sorted(name for name in set(old) | set(new) if old.get(name) != new.get(name))
+            raise ValueError("{} holds a sweep with other settings ({}); use another directory".format(out_dir, ", ".join(changed)))
+        return
+    if any(f.endswith(".csv") for f in os.listdir(out_dir)):
+        raise ValueError("{} holds runs of a sweep without {}; use another directory".format(out_dir, MANIFEST_FILE))
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+
+def run_seed(base_seed, params, iteration):
+    """
+    Returns the seed of a run, derived from the base seed and the run's parameters.
+    """
+    sequence = np.random.SeedSequence([base_seed, params["N_strategic_cops"], params["ethnic_distribution"], iteration])
+    return int(sequence.generate_state(1)[0])
+
+
+def seed_everything(seed):
+    """
+    Seeds the global random number generators used by the agents.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def make_tasks(model_params, strategic_levels, distributions, iterations, base_seed):
+    """
+    Returns one task (parameters, iteration, seed) per run of the sweep.
+    """
+    tasks = []
+    for n_strategic, distribution, iteration in itertools.product(strategic_levels, distributions, range(iterations)):
+        params = dict(model_params, N_strategic_cops=n_strategic, ethnic_distribution=distribution)
+        tasks.append((params, iteration, run_seed(base_seed, params, iteration)))
+    return tasks
+
+
+def simulate(params, iteration, seed, max_steps, data_collection_period):
+    """
+    Runs one model and returns its rows (model and civilian data every data_collection_period
+    steps and at the last step) as a DataFrame.
+    """
+    import pandas as pd
+
+    seed_everything(seed)
+    model = Map(**params, collect_period=data_collection_period, seed=seed)
+    dc = model.datacollector
+    try:
+        while model.running and model.schedule.steps < max_steps:
+            model.step()
+        # Record the civilians at the last step as well.
+        last_step = model.schedule.steps - 1
+        if last_step not in dc._agent_records:
+            dc.collect_civilians(model, last_step)
+    finally:
+        model.close()
+
+    rows = []
+    for step in sorted(dc._agent_records):
+        model_data = {var: values[step] for var, values in dc.model_vars.items()}
+        for record in dc._agent_records[step]:
+            rows.append({
+                "iteration": iteration,
+                "Step": step,
+                **params,
+                **model_data,
+                "AgentID": record[1],
+                **dict(zip(dc.agent_reporters, record[2:])),
+            })
+    df = pd.DataFrame(rows)
+    return df.loc[:, df.columns.intersection(RUN_COLUMNS)]
+
+
+def summarise_civilians(table):
+    """
+    Returns the summary of the civilians of a run (arrays of Map.civilian_table) as one row per
+    ethnicity and zone: the civilians, victimisations, victims, stop and searches, civilians
+    stopped, the rates per civilian and the civilians victimised 0, 1, ... times.
+    """
+    import pandas as pd
+
+    df = pd.DataFrame({
+        "Ethnicity": table["ethnicity"],
+        "zone": table["zone"],
+        "victimisations": table["N_victimised"],
+        "victims": table["N_victimised"] > 0,
+        "stop_searches": table["stop_searched"],
+        "stopped": table["stop_searched"] > 0,
+    })
+    repeats = np.minimum(df["victimisations"].to_numpy(), REPEAT_VICTIMISATION_MAX)
+    repeat_names = ["victimised_{}".format(k) for k in range(REPEAT_VICTIMISATION_MAX)] + ["victimised_{}+".format(REPEAT_VICTIMISATION_MAX)]
+    for k, name in enumerate(repeat_names):
+        df[name] = repeats == k
+
+    summary = df.groupby(["Ethnicity", "zone"]).sum().astype(np.int64)
+    summary.insert(0, "civilians", df.groupby(["Ethnicity", "zone"]).size())
+    summary.insert(summary.columns.get_loc("victims") + 1, "victimisation_rate", summary["victimisations"] / summary["civilians"])
+    summary.insert(summary.columns.get_loc("stopped") + 1, "stop_rate", summary["stop_searches"] / summary["civilians"])
+    return summary.reset_index()
+
+
+def simulate_summary(params, iteration, seed, max_steps, sample_rows=0):
+    """
+    Runs one model without recording civilian rows and returns the summary of its civilians
+    at the end (summarise_civilians, with the run columns) and, if sample_rows > 0, the rows
+    of that many randomly chosen civilians as in simulate (otherwise None).
+    """
+    import pandas as pd
+
+    seed_everything(seed)
+    model = Map(**params, collect_period=0, seed=seed)
+    try:
+        while model.running and model.schedule.steps < max_steps:
+            model.step()
+        table = model.civilian_table()
+    finally:
+        model.close()
+    run = {
+        "iteration": iteration,
+        "Step": model.schedule.steps,
+        "N_strategic_cops": params["N_strategic_cops"],
+        "ethnic_distribution": params["ethnic_distribution"],
+    }
+    summary = summarise_civilians(table)
+    for i, (name, value) in enumerate(run.items()):
+        summary.insert(i, name, value)
+
+    sample = None
+    if sample_rows > 0:
+        n = len(table["unique_id"])
+        rows = np.sort(np.random.default_rng(seed).choice(n, min(sample_rows, n), replace=False))
+        sample = pd.DataFrame({
+            **run,
+            "Victimised": model.victimisations.total,
+            "Stopped_Searched": model.stop_searches.total,
+            "AgentID": table["unique_id"][rows],
+            "Ethnicity": table["ethnicity"][rows],
+            "zone": table["zone"][rows],
+            "N_victimised": table["N_victimised"][rows],
+            "N_stop_searched": table["stop_searched"][rows],
+        })
+        sample = sample.loc[:, [name for name in RUN_COLUMNS if name in sample.columns]]
+    return summary, sample
+
+
+def write_run(df, out_dir, key):
+    """
+    Writes the rows of a run to its result file.
+    """
+    # Write to a temporary file first so that a crash never leaves a partial result.
+    path = os.path.join(out_dir, key + ".csv")
+    df.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def execute(task):
+    """
+    Runs one task and writes its result file: its civilian rows or, if the task is summarised,
+    its run summary (and sampled rows to SAMPLE_DIR). Returns the name of the run and the result.
+    """
+    params, iteration, seed, out_dir, max_steps, data_collection_period, summarised, sample_rows = task
+    key = run_key(params, iteration)
+    if summarised:
+        # Only the summary and the sample leave the worker.
+        df, sample = simulate_summary(params, iteration, seed, max_steps, sample_rows)
+        if sample is not None:
+            os.makedirs(os.path.join(out_dir, SAMPLE_DIR), exist_ok=True)
+            write_run(sample, os.path.join(out_dir, SAMPLE_DIR), key)
+    else:
+        df = simulate(params, iteration, seed, max_steps, data_collection_period)
+    write_run(df, out_dir, key)
+    return key, df
+
+
+def run_one(task):
+    """
+    Runs one task and writes its result file. Returns the name of the run.
+    """
+    return execute(task)[0]
+
+
+def run_measured(task):
+    """
+    Runs one task and writes its result file. Returns the name of the run and its run_metrics.
+    """
+    key, df = execute(task)
+    return key, run_metrics(df)
+
+
+def run_metrics(df):
+    """
+    Returns the monthly metrics of a run from its rows or its summary: Victimised,
+    Stopped_Searched and the stop rate (stop and searches per civilian) of every ethnicity,
+    at the last step scaled to a MONTH of ticks.
+    """
+    step = df["Step"].max()
+    last = df[df["Step"] == step]
+    if "civilians" not in last.columns:
+        last = summarise_civilians({
+            "ethnicity": last["Ethnicity"].to_numpy(),
+            "zone": last["zone"].to_numpy(),
+            "N_victimised": last["N_victimised"].to_numpy(),
+            "stop_searched": last["N_stop_searched"].to_numpy(),
+        })
+    per_month = MONTH / max(int(step), 1)
+    metrics = {
+        "Victimised": float(last["victimisations"].sum()) * per_month,
+        "Stopped_Searched": float(last["stop_searches"].sum()) * per_month,
+    }
+    by_ethnicity = last.groupby("Ethnicity")[["civilians", "stop_searches"]].sum()
+    for ethnicity in ETHNICITIES:
+        rate = 0.0
+        if ethnicity in by_ethnicity.index:
+            rate = by_ethnicity.at[ethnicity, "stop_searches"] / by_ethnicity.at[ethnicity, "civilians"]
+        metrics["stop_rate_" + ethnicity] = float(rate) * per_month
+    return metrics
+
+
+def interval_width(values, confidence=CI_CONFIDENCE):
+    """
+    Returns the width of the Student t confidence interval of the mean of values
+    (infinite with fewer than two values).
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return np.inf
+    t = sct.t.ppf((1 + confidence) / 2, len(values) - 1)
+    return 2 * t * values.std(ddof=1) / np.sqrt(len(values))
+
+
+def converged(runs, target_width=CI_TARGET_WIDTH, confidence=CI_CONFIDENCE):
+    """
+    Returns True if the confidence interval of every metric of the runs (run_metrics dicts)
+    is at most target_width times its mean. A metric that is zero in every run has not
+    converged: its interval is empty only because the outcome was not seen yet.
+    """
+    for name in runs[0]:
+        values = [run[name] for run in runs]
+        if not any(values):
+            return False
+        if interval_width(values, confidence) > target_width * abs(np.mean(values)):
+            return False
+    return True
+
+
+def run_sweep(model_params, strategic_levels, distributions, iterations, out_dir,
+    processes=None, base_seed=0, max_steps=RUN_LENGTH, data_collection_period=RUN_LENGTH, display_progress=True,
+    summarised=False, sample_rows=0):
+    """
+    Runs every combination of strategic cop level, ethnic distribution and iteration in a
+    process pool (processes=None uses all cores) and writes each run to out_dir as it finishes.
+    Runs whose result file already exists are skipped, so an interrupted sweep can be restarted
+    with the same settings (see check_manifest). Returns the names of the runs done in this call.
+
+    If summarised, the result file of a run is its summary (see simulate_summary), with
+    sample_rows sampled civilian rows in SAMPLE_DIR, instead of all its civilian rows.
+    Summarised and full runs should not share out_dir.
+
+    Distributed models start worker processes of their own, which the workers of a
+    process pool cannot, so their runs are made one at a time in this process.
+    """
+    if model_params.get("distributed"):
+        processes = 1
+    os.makedirs(out_dir, exist_ok=True)
+    check_manifest(out_dir, sweep_manifest(model_params, base_seed, max_steps, data_collection_period, summarised, sample_rows))
+    tasks = []
+    for params, iteration, seed in make_tasks(model_params, strategic_levels, distributions, iterations, base_seed):
+        if not os.path.exists(os.path.join(out_dir, run_key(params, iteration) + ".csv")):
+            tasks.append((params, iteration, seed, out_dir, max_steps, data_collection_period, summarised, sample_rows))
+
+    done = []
+    with tqdm(total=len(tasks), disable=not display_progress) as pbar:
+        if processes == 1:
+            for task in tasks:
+                done.append(run_one(task))
+                pbar.update()
+        else:
+            with Pool(processes) as pool:
+                for key in pool.imap_unordered(run_one, tasks):
+                    done.append(key)
+                    pbar.update()
+    return done
+
+
+def run_adaptive_sweep(model_params, strategic_levels, distributions, out_dir, target_width=CI_TARGET_WIDTH,
+    confidence=CI_CONFIDENCE, min_iterations=MIN_ITERATIONS, max_iterations=MAX_ITERATIONS, budget=None,
+    processes=None, base_seed=0, max_steps=RUN_LENGTH, data_collection_period=RUN_LENGTH, display_progress=True,
+    summarised=False, sample_rows=0):
+    """
+    Runs every combination of strategic cop level and ethnic distribution with sequential
+    stopping: each configuration gets min_iterations replicates and then more, in rounds that
+    fill the process pool, until the interval of every metric of run_metrics has converged,
+    it has max_iterations replicates or budget runs have been done in this call.
+
+    The runs are those of run_sweep (same names, seeds and summarised option), so runs already in out_dir count
+    and an interrupted sweep can be restarted; distributed models run in this process, as in run_sweep.
+    Writes CONVERGENCE_FILE to out_dir and returns it as a DataFrame.
+    """
+    import pandas as pd
+
+    if model_params.get("distributed"):
+        processes = 1
+    os.makedirs(out_dir, exist_ok=True)
+    check_manifest(out_dir, sweep_manifest(model_params, base_seed, max_steps, data_collection_period, summarised, sample_rows))
+    n_workers = 1 if processes == 1 else (processes or os.cpu_count())
+    configs = [dict(model_params, N_strategic_cops=n_strategic, ethnic_distribution=distribution)
+        for n_strategic, distribution in itertools.product(strategic_levels, distributions)]
+
+    # The metrics of the runs already done, from iteration 0 on.
+    runs = []
+    for params in configs:
+        done = []
+        while os.path.exists(os.path.join(out_dir, run_key(params, len(done)) + ".csv")):
+            done.append(run_metrics(pd.read_csv(os.path.join(out_dir, run_key(params, len(done)) + ".csv"))))
+        runs.append(done)
+
+    def open_configs():
+        return [i for i, params in enumerate(configs) if len(runs[i]) < max_iterations
+            and (len(runs[i]) < min_iterations or not converged(runs[i], target_width, confidence))]
+
+    n_runs = 0
+    pool = None if n_workers == 1 else Pool(processes)
+    try:
+        with tqdm(disable=not display_progress) as pbar:
+            while True:
+                pending = open_configs()
+                left = np.inf if budget is None else budget - n_runs
+                if not pending or left <= 0:
+                    break
+
+                # Bring every open configuration to min_iterations, or add an equal share of the pool.
+                share = -(-n_workers // len(pending))
+                # The iterations are taken in turn from the configurations, so a budget is shared between them.
+                wanted = {i: range(len(runs[i]), min(max(min_iterations, len(runs[i]) + share), max_iterations)) for i in pending}
+                tasks = []
+                owners = [] # The configuration of every task.
+                for k in range(max(len(iterations) for iterations in wanted.values())):
+                    for i, iterations in wanted.items():
+                        if k < len(iterations) and len(tasks) < left:
+                            seed = run_seed(base_seed, configs[i], iterations[k])
+                            tasks.append((configs[i], iterations[k], seed, out_dir, max_steps, data_collection_period,
+                                summarised, sample_rows))
+                            owners.append(i)
+
+                results = map(run_measured, tasks) if pool is None else pool.imap(run_measured, tasks)
+                for i, (key, metrics) in zip(owners, results):
+                    runs[i].append(metrics)
+                    n_runs += 1
+                    pbar.update()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    rows = []
+    for params, done in zip(configs, runs):
+        row = {
+            "N_strategic_cops": params["N_strategic_cops"],
+            "ethnic_distribution": params["ethnic_distribution"],
+            "iterations": len(done),
+            "converged": len(done) >= max(min_iterations, 2) and converged(done, target_width, confidence),
+        }
+        for name in (done[0] if done else {}):
+            values = [run[name] for run in done]
+            row[name + "_mean"] = float(np.mean(values))
+            row[name + "_width"] = float(interval_width(values, confidence))
+        rows.append(row)
+    summary = pd.DataFrame(rows)
+    summary.to_csv(os.path.join(out_dir, CONVERGENCE_FILE), index=False)
+    return summary
+
+
+def load_sweep(out_dir):
+    """
+    Reads all run files of a sweep into one DataFrame.
+    """
+    import pandas as pd
+
+    files = sorted(f for f in os.listdir(out_dir) if f.endswith(".csv") and f != CONVERGENCE_FILE)
+    return pd.concat([pd.read_csv(os.path.join(out_dir, f)) for f in files], ignore_index=True)